@@ -1,3 +1,5 @@
 from .llm import *
 from .prompt import *
-from .providers.factory import *
\ No newline at end of file
+from .providers.factory import *
+from .singleflight import *
+from .deadline import *
@@ -0,0 +1,3 @@
+from muxllm.cli import main
+
+main()
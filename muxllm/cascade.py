@@ -0,0 +1,207 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional, Union
+
+from pydantic import BaseModel
+
+from muxllm.llm import LLM
+from muxllm.prompt import Prompt
+from muxllm.providers.base import LLMResponse
+from muxllm.providers.factory import Provider
+
+'''
+# usage
+
+cascade = Cascade([
+    (Provider.groq, "llama3-8b-instruct"),
+    (Provider.openai, "gpt-4"),
+], accept=schema_check(MyOutput))
+
+result = cascade.ask("Extract the fields from {{text}} as json", text="...")
+print(result.response.message, result.tier)
+
+# cheap tiers that keep failing for a prompt template are skipped for that template
+print(cascade.stats())
+'''
+
+Check = Callable[[LLMResponse], bool]
+
+def schema_check(model : type[BaseModel]) -> Check:
+    # accepts responses whose message is json matching the pydantic model
+    def check(response : LLMResponse) -> bool:
+        if not response.message:
+            return False
+        text = response.message.strip()
+        # models often wrap json in a markdown code block
+        if text.startswith("```"):
+            text = text.strip("`")
+            text = text[text.index("\n") + 1:] if "\n" in text else text
+        try:
+            model.model_validate(json.loads(text))
+        except ValueError:
+            return False
+        return True
+    return check
+
+def _token_logprobs(response : LLMResponse) -> Optional[list[float]]:
+    raw = response.raw_response
+    choices = raw.get("choices") if isinstance(raw, dict) else getattr(raw, "choices", None)
+    if not choices:
+        return None
+    logprobs = choices[0].get("logprobs") if isinstance(choices[0], dict) else getattr(choices[0], "logprobs", None)
+    if logprobs is None:
+        return None
+    content = logprobs.get("content") if isinstance(logprobs, dict) else getattr(logprobs, "content", None)
+    if not content:
+        return None
+    return [token["logprob"] if isinstance(token, dict) else token.logprob for token in content]
+
+def logprob_threshold(min_avg_logprob : float) -> Check:
+    # accepts responses whose average token logprob is at least min_avg_logprob.
+    # Needs a provider that returns logprobs (e.g. openai with logprobs=True), responses without them are rejected
+    def check(response : LLMResponse) -> bool:
+        logprobs = _token_logprobs(response)
+        if not logprobs:
+            return False
+        return sum(logprobs) / len(logprobs) >= min_avg_logprob
+    return check
+
+def all_of(*checks : Check) -> Check:
+    def check(response : LLMResponse) -> bool:
+        return all(c(response) for c in checks)
+    return check
+
+class CascadeAttempt(BaseModel):
+    tier: int
+    model: str
+    accepted: bool
+    latency: float
+
+class CascadeResult(BaseModel):
+    response: LLMResponse
+    tier: int # index of the tier that answered
+    attempts: list[CascadeAttempt]
+    skipped: int # number of cheap tiers skipped because of the template's history
+
+class _TierStats:
+    __slots__ = ("attempts", "rejections")
+
+    def __init__(self):
+        self.attempts = 0
+        self.rejections = 0
+
+class _TemplateStats:
+    __slots__ = ("calls", "tiers")
+
+    def __init__(self, tiers : int):
+        self.calls = 0
+        self.tiers = [_TierStats() for _ in range(tiers)]
+
+class Cascade:
+    def __init__(self, tiers : list[Union[LLM, tuple[Provider, str]]], accept : Union[Check, list[Check], None] = None,
+                 system_prompt : Optional[Union[str, Prompt]] = None, min_samples : int = 5, skip_threshold : float = 0.8,
+                 probe_every : int = 20, max_templates : int = 1000):
+        if not tiers:
+            raise ValueError("A cascade needs at least one tier")
+        self.tiers = [tier if isinstance(tier, LLM) else LLM(tier[0], tier[1], system_prompt=system_prompt) for tier in tiers]
+        # one check for every tier, or a list with a check per tier except the last (the last tier is always accepted)
+        if accept is None or callable(accept):
+            accept = [accept] * (len(self.tiers) - 1)
+        if len(accept) < len(self.tiers) - 1:
+            raise ValueError("accept needs a check for every tier except the last")
+        self.accept = accept
+
+        # a tier is skipped for a template once it was rejected for at least skip_threshold of min_samples attempts.
+        # Every probe_every calls of that template, skipped tiers are tried again in case things changed
+        self.min_samples = min_samples
+        self.skip_threshold = skip_threshold
+        self.probe_every = probe_every
+        # the stats of the max_templates most recently used templates are kept
+        self.max_templates = max_templates
+        self.lock = threading.Lock()
+        self.templates : OrderedDict[str, _TemplateStats] = OrderedDict()
+
+    def template_key(self, prompt : Union[str, Prompt]) -> Optional[str]:
+        # the template, before {{variables}} are filled in. A string without {{variables}} is an already formatted
+        # prompt rather than a template, so it isn't tracked
+        if isinstance(prompt, Prompt):
+            return prompt.raw_prompt
+        return prompt if "{{" in prompt else None
+
+    def template_stats(self, template : str) -> _TemplateStats:
+        # called with the lock held
+        stats = self.templates.get(template)
+        if stats is None:
+            stats = self.templates[template] = _TemplateStats(len(self.tiers))
+            while len(self.templates) > self.max_templates:
+                self.templates.popitem(last=False)
+        else:
+            self.templates.move_to_end(template)
+        return stats
+
+    def start_tier(self, template : Optional[str]) -> int:
+        if template is None:
+            return 0
+        with self.lock:
+            stats = self.template_stats(template)
+            stats.calls += 1
+            if self.probe_every and stats.calls % self.probe_every == 0:
+                return 0
+            for i, tier_stats in enumerate(stats.tiers[:-1]):
+                if tier_stats.attempts < self.min_samples or tier_stats.rejections / tier_stats.attempts < self.skip_threshold:
+                    return i
+            return len(self.tiers) - 1
+
+    def record(self, template : Optional[str], tier : int, accepted : bool):
+        if template is None:
+            return
+        with self.lock:
+            tier_stats = self.template_stats(template).tiers[tier]
+            tier_stats.attempts += 1
+            if not accepted:
+                tier_stats.rejections += 1
+
+    def is_accepted(self, tier : int, response : LLMResponse) -> bool:
+        if tier == len(self.tiers) - 1 or self.accept[tier] is None:
+            return True
+        try:
+            return bool(self.accept[tier](response))
+        except Exception:
+            return False
+
+    def ask(self, prompt : Union[str, Prompt], **kwargs) -> CascadeResult:
+        template = self.template_key(prompt)
+        start = self.start_tier(template)
+        attempts = []
+        for i in range(start, len(self.tiers)):
+            t = time.perf_counter()
+            response = self.tiers[i].ask(prompt, **kwargs)
+            accepted = self.is_accepted(i, response)
+            attempts.append(CascadeAttempt(tier=i, model=self.tiers[i].model, accepted=accepted, latency=time.perf_counter() - t))
+            self.record(template, i, accepted)
+            if accepted:
+                break
+        return CascadeResult(response=response, tier=i, attempts=attempts, skipped=start)
+
+    async def ask_async(self, prompt : Union[str, Prompt], **kwargs) -> CascadeResult:
+        template = self.template_key(prompt)
+        start = self.start_tier(template)
+        attempts = []
+        for i in range(start, len(self.tiers)):
+            t = time.perf_counter()
+            response = await self.tiers[i].ask_async(prompt, **kwargs)
+            accepted = self.is_accepted(i, response)
+            attempts.append(CascadeAttempt(tier=i, model=self.tiers[i].model, accepted=accepted, latency=time.perf_counter() - t))
+            self.record(template, i, accepted)
+            if accepted:
+                break
+        return CascadeResult(response=response, tier=i, attempts=attempts, skipped=start)
+
+    def stats(self) -> dict[str, list[dict[str, Any]]]:
+        with self.lock:
+            return {
+                template: [{"model": self.tiers[i].model, "attempts": s.attempts, "rejections": s.rejections} for i, s in enumerate(stats.tiers)]
+                for template, stats in self.templates.items()
+            }
@@ -0,0 +1,52 @@
+import argparse
+import asyncio
+from typing import Optional
+
+def serve(args):
+    from muxllm.server import Gateway
+    from muxllm.transport import Cassette
+
+    cassette = Cassette(args.cassette, mode=args.cassette_mode, latency=args.cassette_latency) if args.cassette else None
+    gateway = Gateway(cache_size=args.cache_size, cache_ttl=args.cache_ttl,
+                      max_concurrency=args.max_concurrency, requests_per_second=args.rate_limit, cassette=cassette,
+                      request_timeout=args.timeout)
+    print(f"muxllm gateway listening on http://{args.host}:{args.port}/v1")
+    try:
+        asyncio.run(gateway.serve(args.host, args.port, args.backlog))
+    except KeyboardInterrupt:
+        pass
+
+def profile_report(args):
+    from muxllm import profiling
+    print(profiling.report(args.file, folded=args.folded))
+
+def main(argv : Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(prog="muxllm")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="Run an OpenAI compatible gateway in front of every muxllm provider")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8000)
+    serve_parser.add_argument("--backlog", type=int, default=1024, help="Max number of pending connections")
+    serve_parser.add_argument("--cache-size", type=int, default=0, help="Number of responses to cache, 0 disables caching")
+    serve_parser.add_argument("--cache-ttl", type=float, default=None, help="Seconds a cached response stays valid")
+    serve_parser.add_argument("--max-concurrency", type=int, default=64, help="Max concurrent upstream requests per provider")
+    serve_parser.add_argument("--rate-limit", type=float, default=None, help="Max upstream requests per second per provider")
+    serve_parser.add_argument("--timeout", type=float, default=None, help="Seconds a request may take before it fails with a 504")
+    serve_parser.add_argument("--cassette", default=None, help="Record upstream traffic to, or replay it from, this cassette file")
+    serve_parser.add_argument("--cassette-mode", choices=["record", "replay"], default="replay")
+    serve_parser.add_argument("--cassette-latency", type=float, default=0.0, help="Multiplier of the recorded latency when replaying, 0 replays at full speed")
+    serve_parser.set_defaults(func=serve)
+
+    profile_parser = subparsers.add_parser("profile", help="Inspect profiles dumped with muxllm.profiling.dump")
+    profile_subparsers = profile_parser.add_subparsers(dest="profile_command", required=True)
+    report_parser = profile_subparsers.add_parser("report", help="Print the time spent per stage")
+    report_parser.add_argument("file", help="A profile written by muxllm.profiling.dump")
+    report_parser.add_argument("--folded", action="store_true", help="Print folded stacks for flamegraph tools instead")
+    report_parser.set_defaults(func=profile_report)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
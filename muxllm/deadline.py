@@ -0,0 +1,238 @@
+import asyncio
+import contextlib
+import inspect
+import threading
+import time
+from typing import Any, Awaitable, Callable, Optional, Union
+
+'''
+# usage
+
+deadline = Deadline(10) # 10 seconds from now, Deadline() never expires but can still be cancelled
+
+response = llm.ask("...", deadline=deadline)
+response = await llm.ask_async("...", deadline=deadline)
+
+# e.g. when the client disconnects, from any thread. In flight async calls are cancelled,
+# streams are closed and calls that haven't started yet raise Cancelled
+deadline.cancel()
+'''
+
+# seconds that need to be left for the sdk clients to retry a failed request
+MIN_RETRY_TIME = 2.0
+# backoff between the retries of sync calls, doubled after every attempt
+RETRY_DELAY = 0.5
+MAX_RETRY_DELAY = 8.0
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+class Cancelled(Exception):
+    pass
+
+class Deadline:
+    def __init__(self, timeout : Optional[float] = None):
+        self.expires_at = time.monotonic() + timeout if timeout is not None else None
+        self.cancelled = False
+        self.lock = threading.Lock()
+        self.callbacks : list[Callable[[], Any]] = []
+
+    def remaining(self) -> Optional[float]:
+        # seconds left, None if there is no time limit
+        if self.expires_at is None:
+            return None
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    @property
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    @property
+    def done(self) -> bool:
+        return self.cancelled or self.expired
+
+    def error(self) -> Optional[Exception]:
+        if self.cancelled:
+            return Cancelled("The call was cancelled")
+        if self.expired:
+            return DeadlineExceeded("The deadline was exceeded")
+        return None
+
+    def check(self):
+        error = self.error()
+        if error is not None:
+            raise error
+
+    def on_cancel(self, callback : Callable[[], Any]) -> Callable[[], None]:
+        # callback is called (from the thread that cancels) when cancel() is called. Returns a function that unregisters it
+        with self.lock:
+            if self.cancelled:
+                run_now = True
+            else:
+                run_now = False
+                self.callbacks.append(callback)
+        if run_now:
+            callback()
+
+        def unregister():
+            with self.lock:
+                if callback in self.callbacks:
+                    self.callbacks.remove(callback)
+        return unregister
+
+    def cancel(self):
+        with self.lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def bound_client(self, client, max_retries : Optional[int] = None):
+        # an sdk client (openai, groq, anthropic) that gives up when the deadline does. It shares the connection pool of client.
+        # The client's retries are kept, unless so little time is left that a retry couldn't finish anyway. Every retry gets
+        # the same timeout, so this is only safe for async calls, which are stopped at the deadline (see call_with_deadline)
+        self.check()
+        options = {}
+        remaining = self.remaining()
+        if remaining is not None:
+            options["timeout"] = remaining
+            if remaining < MIN_RETRY_TIME:
+                max_retries = 0
+        if max_retries is not None:
+            options["max_retries"] = max_retries
+        return client.with_options(**options) if options else client
+
+    @contextlib.asynccontextmanager
+    async def scope(self):
+        # cancels the current task when the deadline expires or cancel() is called
+        self.check()
+        loop = asyncio.get_running_loop()
+        task = asyncio.current_task()
+        fired = []
+
+        def expire():
+            fired.append(True)
+            task.cancel()
+
+        remaining = self.remaining()
+        handle = loop.call_later(remaining, expire) if remaining is not None else None
+        unregister = self.on_cancel(lambda: loop.call_soon_threadsafe(task.cancel))
+        try:
+            yield self
+        except asyncio.CancelledError:
+            if not (self.cancelled or fired):
+                raise
+            # the cancellation came from this deadline, so it is turned into an exception the caller can handle
+            if hasattr(task, "uncancel"):
+                task.uncancel()
+            if self.cancelled:
+                raise Cancelled("The call was cancelled")
+            raise DeadlineExceeded("The deadline was exceeded")
+        finally:
+            if handle is not None:
+                handle.cancel()
+            unregister()
+
+    async def run(self, awaitable : Awaitable) -> Any:
+        try:
+            self.check()
+        except Exception:
+            # don't leave a coroutine that was never awaited
+            if inspect.iscoroutine(awaitable):
+                awaitable.close()
+            raise
+        async with self.scope():
+            return await awaitable
+
+def as_deadline(deadline : Union[None, float, Deadline]) -> Optional[Deadline]:
+    # deadlines can be given as a Deadline or as a number of seconds
+    if deadline is None or isinstance(deadline, Deadline):
+        return deadline
+    return Deadline(deadline)
+
+def pop_deadline(kwargs : dict) -> Optional[Deadline]:
+    deadline = as_deadline(kwargs.pop("deadline", None))
+    if deadline is not None:
+        deadline.check()
+    return deadline
+
+def is_retryable(error : Exception) -> bool:
+    # what the sdks (openai, groq, anthropic) retry: connection errors, timeouts, 408, 409, 429 and 5xx
+    status = getattr(error, "status_code", None)
+    if isinstance(status, int):
+        return status in (408, 409, 429) or status >= 500
+    return any(cls.__name__ == "APIConnectionError" for cls in type(error).__mro__)
+
+def call_with_deadline(deadline : Optional[Deadline], call : Callable[[], Any], retries : int = 0) -> Any:
+    # runs a sync sdk call, which can't be interrupted once it is sent. call makes a single attempt with the time that is
+    # left as its timeout. Failed attempts are retried like the sdks do, but only while there is time left for them, and
+    # a failure once the deadline is done raises DeadlineExceeded (or Cancelled)
+    if deadline is None:
+        return call()
+    attempt = 0
+    while True:
+        deadline.check()
+        try:
+            return call()
+        except (DeadlineExceeded, Cancelled):
+            raise
+        except Exception as e:
+            if deadline.done:
+                raise deadline.error() from e
+            delay = min(RETRY_DELAY * 2 ** attempt, MAX_RETRY_DELAY)
+            remaining = deadline.remaining()
+            if attempt >= retries or not is_retryable(e) or (remaining is not None and delay >= remaining):
+                raise
+            time.sleep(delay)
+            attempt += 1
+
+async def run_with_deadline(deadline : Optional[Deadline], awaitable : Awaitable) -> Any:
+    if deadline is None:
+        return await awaitable
+    return await deadline.run(awaitable)
+
+async def aiter_with_deadline(deadline : Optional[Deadline], iterable):
+    # every step of the async iterator is run under the deadline
+    if deadline is None:
+        async for item in iterable:
+            yield item
+        return
+    iterator = iterable.__aiter__()
+    while True:
+        try:
+            item = await deadline.run(iterator.__anext__())
+        except StopAsyncIteration:
+            return
+        yield item
+
+def iter_with_deadline(deadline : Optional[Deadline], response):
+    # iterates a sync stream, closing it when the deadline expires or is cancelled so a blocked read returns
+    if deadline is None:
+        yield from response
+        return
+    close = getattr(response, "close", None)
+    unregister = deadline.on_cancel(close) if close is not None else (lambda: None)
+    remaining = deadline.remaining()
+    timer = threading.Timer(remaining, close) if close is not None and remaining is not None else None
+    if timer is not None:
+        timer.daemon = True
+        timer.start()
+    try:
+        for item in response:
+            deadline.check()
+            yield item
+    except Exception as e:
+        if isinstance(e, (DeadlineExceeded, Cancelled)) or not deadline.done:
+            raise
+        # reading failed because the stream was closed by the deadline
+        deadline.check()
+    finally:
+        unregister()
+        if timer is not None:
+            timer.cancel()
+    deadline.check()
@@ -0,0 +1,193 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, TYPE_CHECKING
+
+import numpy as np
+
+from muxllm.deadline import as_deadline
+from muxllm.singleflight import IGNORED_KWARGS
+
+if TYPE_CHECKING:
+    from muxllm.providers.base import BaseProvider
+
+'''
+# usage
+
+llm = LLM(Provider.openai, "text-embedding-3-small")
+cache = VectorCache("./embeddings")
+
+vectors = llm.embed(["first document", "second document"], cache=cache) # np.ndarray of shape (2, dim)
+
+# only texts that are not in the cache are sent to the provider
+vectors = llm.embed(["first document", "a new document"], cache=cache)
+'''
+
+def text_hash(text : str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class VectorCache:
+    # on disk cache of embeddings keyed by the hash of the text. Each model gets its own directory with
+    # - vectors.f32: every vector as raw float32, appended in row order and memory-mapped for reads
+    # - keys.txt: the text hash of each row, one per line
+    # - meta.json: the model and dimension of the vectors
+    def __init__(self, path : str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.stores : dict[str, dict] = {}
+
+    def _store(self, model : str) -> dict:
+        if model in self.stores:
+            return self.stores[model]
+
+        directory = os.path.join(self.path, hashlib.sha1(model.encode("utf-8")).hexdigest()[:16])
+        store = {"dir": directory, "dim": None, "index": {}, "mmap": None}
+        meta_fp = os.path.join(directory, "meta.json")
+        keys_fp = os.path.join(directory, "keys.txt")
+        if os.path.exists(meta_fp):
+            with open(meta_fp, "r") as f:
+                store["dim"] = json.load(f)["dim"]
+            if os.path.exists(keys_fp):
+                with open(keys_fp, "r") as f:
+                    keys = f.read().split()
+                # a put interrupted between writing the vectors and the keys leaves rows without a key (or the other way
+                # around). Both files are cut back to the rows they agree on, so new rows are appended at the right index
+                vectors_fp = os.path.join(directory, "vectors.f32")
+                row_size = 4 * store["dim"]
+                rows = min(len(keys), os.path.getsize(vectors_fp) // row_size)
+                if os.path.getsize(vectors_fp) != rows * row_size:
+                    os.truncate(vectors_fp, rows * row_size)
+                if len(keys) != rows:
+                    with open(keys_fp, "w") as f:
+                        f.write("".join(key + "\n" for key in keys[:rows]))
+                store["index"] = {key: i for i, key in enumerate(keys[:rows])}
+        self.stores[model] = store
+        return store
+
+    def _vectors(self, store : dict) -> np.ndarray:
+        rows = len(store["index"])
+        if store["mmap"] is None or store["mmap"].shape[0] != rows:
+            store["mmap"] = np.memmap(os.path.join(store["dir"], "vectors.f32"), dtype=np.float32, mode="r", shape=(rows, store["dim"]))
+        return store["mmap"]
+
+    def get(self, model : str, texts : list[str]) -> tuple[dict[str, np.ndarray], list[str]]:
+        # returns the cached vectors by text hash, and the texts that are missing
+        with self.lock:
+            store = self._store(model)
+            found, missing = {}, []
+            if not store["index"]:
+                return found, list(texts)
+            vectors = self._vectors(store)
+            for text in texts:
+                key = text_hash(text)
+                row = store["index"].get(key)
+                if row is None:
+                    missing.append(text)
+                else:
+                    found[key] = vectors[row]
+            return found, missing
+
+    def put(self, model : str, texts : list[str], vectors : np.ndarray):
+        if len(texts) == 0:
+            return
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self.lock:
+            store = self._store(model)
+            if store["dim"] is None:
+                store["dim"] = int(vectors.shape[1])
+                os.makedirs(store["dir"], exist_ok=True)
+                with open(os.path.join(store["dir"], "meta.json"), "w") as f:
+                    json.dump({"model": model, "dim": store["dim"]}, f)
+            elif store["dim"] != vectors.shape[1]:
+                raise ValueError(f"Expected vectors of dimension {store['dim']} for {model}, got {vectors.shape[1]}")
+
+            new_keys, new_rows = {}, []
+            for text, vector in zip(texts, vectors):
+                key = text_hash(text)
+                if key not in store["index"] and key not in new_keys:
+                    new_keys[key] = len(new_rows)
+                    new_rows.append(vector)
+            if not new_keys:
+                return
+
+            with open(os.path.join(store["dir"], "vectors.f32"), "ab") as f:
+                f.write(np.stack(new_rows).tobytes())
+            with open(os.path.join(store["dir"], "keys.txt"), "a") as f:
+                f.write("\n".join(new_keys) + "\n")
+            start = len(store["index"])
+            store["index"].update({key: start + i for key, i in new_keys.items()})
+
+def _batches(texts : list[str], batch_size : int) -> list[list[str]]:
+    batch_size = batch_size if batch_size > 0 else len(texts)
+    return [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+
+def _assemble(texts : list[str], found : dict[str, np.ndarray], missing : list[str], vectors : list[list[float]]) -> np.ndarray:
+    for text, vector in zip(missing, vectors):
+        found[text_hash(text)] = np.asarray(vector, dtype=np.float32)
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+    out = np.empty((len(texts), len(next(iter(found.values())))), dtype=np.float32)
+    for i, text in enumerate(texts):
+        out[i] = found[text_hash(text)]
+    return out
+
+def _namespace(provider : "BaseProvider", model : str, kwargs : dict) -> str:
+    # the same model name can mean different models on different providers, and kwargs like dimensions (openai)
+    # or task_type (google) change the vectors, so they are part of the namespace too
+    options = {k: v for k, v in kwargs.items() if k not in IGNORED_KWARGS}
+    namespace = f"{type(provider).__name__}/{model}"
+    if options:
+        namespace += "?" + json.dumps(options, sort_keys=True, separators=(",", ":"), default=str)
+    return namespace
+
+def _lookup(texts : list[str], namespace : str, cache : Optional[VectorCache]) -> tuple[dict[str, np.ndarray], list[str]]:
+    if cache is not None:
+        found, missing = cache.get(namespace, texts)
+    else:
+        found, missing = {}, texts
+    # identical texts are only embedded once
+    return found, list(dict.fromkeys(missing))
+
+def embed(provider : "BaseProvider", texts : list[str], model : str, cache : Optional[VectorCache] = None,
+          max_concurrency : int = 4, **kwargs) -> np.ndarray:
+    found, missing = _lookup(texts, _namespace(provider, model, kwargs), cache)
+    if "deadline" in kwargs:
+        # one deadline for the whole call, shared by every batch
+        kwargs["deadline"] = as_deadline(kwargs["deadline"])
+
+    vectors = []
+    if missing:
+        batches = _batches(missing, provider.embed_batch_size)
+        if len(batches) == 1:
+            vectors = provider.get_embeddings(batches[0], model, **kwargs)
+        else:
+            with ThreadPoolExecutor(max_workers=min(max_concurrency, len(batches))) as pool:
+                for batch_vectors in pool.map(lambda batch: provider.get_embeddings(batch, model, **kwargs), batches):
+                    vectors.extend(batch_vectors)
+        if cache is not None:
+            cache.put(_namespace(provider, model, kwargs), missing, np.asarray(vectors, dtype=np.float32))
+
+    return _assemble(texts, found, missing, vectors)
+
+async def embed_async(provider : "BaseProvider", texts : list[str], model : str, cache : Optional[VectorCache] = None,
+                      max_concurrency : int = 4, **kwargs) -> np.ndarray:
+    found, missing = _lookup(texts, _namespace(provider, model, kwargs), cache)
+    if "deadline" in kwargs:
+        # one deadline for the whole call, shared by every batch
+        kwargs["deadline"] = as_deadline(kwargs["deadline"])
+
+    vectors = []
+    if missing:
+        semaphore = asyncio.Semaphore(max_concurrency)
+        async def run(batch):
+            async with semaphore:
+                return await provider.get_embeddings_async(batch, model, **kwargs)
+        for batch_vectors in await asyncio.gather(*[run(batch) for batch in _batches(missing, provider.embed_batch_size)]):
+            vectors.extend(batch_vectors)
+        if cache is not None:
+            cache.put(_namespace(provider, model, kwargs), missing, np.asarray(vectors, dtype=np.float32))
+
+    return _assemble(texts, found, missing, vectors)
@@ -1,9 +1,19 @@
 from .providers.factory import Provider, create_provider
 from .providers.base import ToolCall, ToolResponse, LLMResponse
-from .tools import ToolBox
+from .tools import ToolBox, ToolStep, ToolRun
 from .prompt import Prompt
-from typing import Optional, Union
+from .singleflight import SingleFlight, request_key
+from .transport import Cassette
+from .profiling import stage
+from .deadline import Deadline, Cancelled, DeadlineExceeded, as_deadline, run_with_deadline
+from typing import Optional, Union, TYPE_CHECKING
+from concurrent.futures import ThreadPoolExecutor, wait
+import asyncio
 import json
+import time
+
+if TYPE_CHECKING:
+    from .embeddings import VectorCache
 
 '''
 # usage
@@ -29,20 +39,62 @@ tool_response = call_tool(resp.tools[0])
 # add tool response to history to keep track of it
 llm.add_tool_response(resp.tools[0], tool_response)
 
+# example with an autonomous tool loop; the model is called until it stops asking for tools
+
+run = llm.run_tools("What is the weather in New York and in Paris?", my_toolbox, max_steps=5, deadline=30)
+print(run.response.message, run.stop_reason, run.model_time, run.tool_time)
+
+# example with request coalescing; identical concurrent requests share one upstream call
+
+flight = SingleFlight()
+llm = LLM(Provider.openai, "gpt-4", single_flight=flight)
+
 '''
 
+# sent back for tool calls that run_tools stopped before running
+SKIPPED_TOOL_RESPONSES = {
+    "max_steps": "Not run: step budget exhausted",
+    "deadline": "Not run: deadline exceeded",
+    "cancelled": "Not run: cancelled",
+}
+
 class LLM:
-    def __init__(self, provider: Provider, model : str,  api_key : Optional[str] = None, system_prompt : Optional[Union[str, Prompt]] = None):
-        self.provider = create_provider(provider, api_key)
+    def __init__(self, provider: Provider, model : str,  api_key : Optional[str] = None, system_prompt : Optional[Union[str, Prompt]] = None,
+                 single_flight : Optional[SingleFlight] = None, cassette : Optional[Cassette] = None):
+        self.provider = create_provider(provider, api_key, cassette=cassette)
         self.model = model
         self.system_prompt = system_prompt
+        self.single_flight = single_flight
         self.history = []
 
         if system_prompt is not None:
             self.history.append(self.provider.parse_system_message(system_prompt))
 
     def __call__(self, messages: list, **kwargs):
-        return self.provider.get_response(messages, self.model, **kwargs)
+        return self.get_response(messages, **kwargs)
+
+    def get_response(self, messages: list, **kwargs) -> LLMResponse:
+        with stage("llm.get_response"):
+            return self._get_response(messages, **kwargs)
+
+    async def get_response_async(self, messages: list, **kwargs) -> LLMResponse:
+        with stage("llm.get_response"):
+            return await self._get_response_async(messages, **kwargs)
+
+    def _get_response(self, messages: list, **kwargs) -> LLMResponse:
+        if self.single_flight is None:
+            return self.provider.get_response(messages, self.model, **kwargs)
+        # the shared call isn't bound to the deadline of whoever started it, the deadline only bounds how long this call waits
+        deadline = as_deadline(kwargs.pop("deadline", None))
+        key = request_key(type(self.provider).__name__, self.model, messages, **kwargs)
+        return self.single_flight.do(key, lambda shared: self.provider.get_response(messages, self.model, deadline=shared, **kwargs), deadline)
+
+    async def _get_response_async(self, messages: list, **kwargs) -> LLMResponse:
+        if self.single_flight is None:
+            return await self.provider.get_response_async(messages, self.model, **kwargs)
+        deadline = as_deadline(kwargs.pop("deadline", None))
+        key = request_key(type(self.provider).__name__, self.model, messages, **kwargs)
+        return await self.single_flight.do_async(key, lambda: self.provider.get_response_async(messages, self.model, **kwargs), deadline)
 
     def save_history(self, fp : str):
         with open(fp, "w") as f:
@@ -56,18 +108,22 @@ class LLM:
         self.history = []
 
     def prep_prompt(self, prompt : Union[str, Prompt], **kwargs):
-        if isinstance(prompt, str):
-            prompt = Prompt(prompt)
-        return prompt.get_kwargs(**kwargs)
-
-    def ask(self, prompt: Union[str, Prompt], system_prompt : Optional[Union[str, Prompt]] = None, **kwargs) -> LLMResponse:
-        prompt, kwargs = self.prep_prompt(prompt, **kwargs)
+        with stage("prompt.prep"):
+            if isinstance(prompt, str):
+                prompt = Prompt(prompt)
+            return prompt.get_kwargs(**kwargs)
 
+    def prep_tools(self, kwargs : dict) -> dict:
         # if tools is in kwargs, check if its a ToolBox and convert it to a dict
         if "tools" in kwargs:
             tools = kwargs["tools"]
             if isinstance(tools, ToolBox):
                 kwargs["tools"] = tools.to_dict()
+        return kwargs
+
+    def prep_ask(self, prompt: Union[str, Prompt], system_prompt : Optional[Union[str, Prompt]] = None, **kwargs) -> tuple[list, dict]:
+        prompt, kwargs = self.prep_prompt(prompt, **kwargs)
+        kwargs = self.prep_tools(kwargs)
 
         messages = []
 
@@ -79,26 +135,247 @@ class LLM:
 
         messages.append(self.provider.parse_user_message(prompt))
 
-        response = self.provider.get_response(messages, self.model, **kwargs)
+        return messages, kwargs
+
+    def ask(self, prompt: Union[str, Prompt], system_prompt : Optional[Union[str, Prompt]] = None, **kwargs) -> LLMResponse:
+        with stage("llm.ask"):
+            messages, kwargs = self.prep_ask(prompt, system_prompt, **kwargs)
+            return self.get_response(messages, **kwargs)
+
+    async def ask_async(self, prompt: Union[str, Prompt], system_prompt : Optional[Union[str, Prompt]] = None, **kwargs) -> LLMResponse:
+        with stage("llm.ask"):
+            messages, kwargs = self.prep_ask(prompt, system_prompt, **kwargs)
+            return await self.get_response_async(messages, **kwargs)
 
-        return response
-     
     def chat(self, prompt: Union[str, Prompt], **kwargs) -> LLMResponse:
+        with stage("llm.chat"):
+            prompt, kwargs = self.prep_prompt(prompt, **kwargs)
+            kwargs = self.prep_tools(kwargs)
+
+            self.history.append(self.provider.parse_user_message(prompt))
+
+            response = self.get_response(self.history, **kwargs)
+
+            self.history.append(self.provider.parse_response(response))
+
+            return response
+
+    async def chat_async(self, prompt: Union[str, Prompt], **kwargs) -> LLMResponse:
+        with stage("llm.chat"):
+            prompt, kwargs = self.prep_prompt(prompt, **kwargs)
+            kwargs = self.prep_tools(kwargs)
+
+            self.history.append(self.provider.parse_user_message(prompt))
+
+            response = await self.get_response_async(self.history, **kwargs)
+
+            self.history.append(self.provider.parse_response(response))
+
+            return response
+
+    def ask_stream(self, prompt: Union[str, Prompt], system_prompt : Optional[Union[str, Prompt]] = None, **kwargs):
+        messages, kwargs = self.prep_ask(prompt, system_prompt, **kwargs)
+        yield from self.provider.get_response_stream(messages, self.model, **kwargs)
+
+    async def ask_stream_async(self, prompt: Union[str, Prompt], system_prompt : Optional[Union[str, Prompt]] = None, **kwargs):
+        messages, kwargs = self.prep_ask(prompt, system_prompt, **kwargs)
+        async for chunk in self.provider.get_response_stream_async(messages, self.model, **kwargs):
+            yield chunk
+
+    def chat_stream(self, prompt: Union[str, Prompt], **kwargs):
         prompt, kwargs = self.prep_prompt(prompt, **kwargs)
+        kwargs = self.prep_tools(kwargs)
 
-        if "tools" in kwargs:
-            tools = kwargs["tools"]
-            if isinstance(tools, ToolBox):
-                kwargs["tools"] = tools.to_dict()
+        self.history.append(self.provider.parse_user_message(prompt))
+
+        for chunk in self.provider.get_response_stream(self.history, self.model, **kwargs):
+            if chunk.done:
+                self.history.append(self.provider.parse_response(chunk.response))
+            yield chunk
+
+    async def chat_stream_async(self, prompt: Union[str, Prompt], **kwargs):
+        prompt, kwargs = self.prep_prompt(prompt, **kwargs)
+        kwargs = self.prep_tools(kwargs)
 
         self.history.append(self.provider.parse_user_message(prompt))
 
-        response = self.provider.get_response(self.history, self.model, **kwargs)
+        async for chunk in self.provider.get_response_stream_async(self.history, self.model, **kwargs):
+            if chunk.done:
+                self.history.append(self.provider.parse_response(chunk.response))
+            yield chunk
+
+    def embed(self, texts : list[str], cache : Optional["VectorCache"] = None, model : Optional[str] = None, **kwargs):
+        return self.provider.embed(texts, model or self.model, cache=cache, **kwargs)
+
+    async def embed_async(self, texts : list[str], cache : Optional["VectorCache"] = None, model : Optional[str] = None, **kwargs):
+        return await self.provider.embed_async(texts, model or self.model, cache=cache, **kwargs)
+
+    def tool_result_to_str(self, toolbox : ToolBox, tool_call : ToolCall, result) -> str:
+        if toolbox.get_tool(tool_call.name) is None:
+            return f"Tool {tool_call.name} is not available"
+        if isinstance(result, str):
+            return result
+        return json.dumps(result, default=str)
+
+    def run_tool(self, toolbox : ToolBox, tool_call : ToolCall, deadline : Optional[Deadline] = None) -> tuple[str, float]:
+        start = time.perf_counter()
+        try:
+            result = self.tool_result_to_str(toolbox, tool_call, toolbox.invoke_tool(tool_call, deadline))
+        except Exception as e:
+            # the error is sent back to the model so it can recover
+            result = f"Error: {e}"
+        return result, time.perf_counter() - start
+
+    async def run_tool_async(self, toolbox : ToolBox, tool_call : ToolCall, deadline : Optional[Deadline] = None) -> tuple[str, float]:
+        start = time.perf_counter()
+        try:
+            result = self.tool_result_to_str(toolbox, tool_call, await toolbox.invoke_tool_async(tool_call, deadline))
+        except Exception as e:
+            result = f"Error: {e}"
+        return result, time.perf_counter() - start
+
+    @staticmethod
+    def stop_reason(deadline : Deadline) -> str:
+        return "cancelled" if deadline.cancelled else "deadline"
+
+    def add_skipped_tool_responses(self, tool_calls : list[ToolCall], stop_reason : str):
+        # providers reject a history where tool calls have no response, so the ones that were not run still get one
+        for tool_call in tool_calls:
+            self.add_tool_response(tool_call, SKIPPED_TOOL_RESPONSES[stop_reason])
+
+    def run_tools(self, prompt: Union[str, Prompt], toolbox : ToolBox, max_steps : int = 10, deadline : Union[float, Deadline, None] = None, **kwargs) -> ToolRun:
+        # max_steps is the max number of model calls. deadline is a wall clock budget in seconds (or a Deadline) for the whole run,
+        # it is passed on to every model call and to tools that take a deadline argument
+        start = time.perf_counter()
+        deadline = as_deadline(deadline)
 
-        self.history.append(self.provider.parse_response(response))
+        prompt, kwargs = self.prep_prompt(prompt, **kwargs)
+        kwargs["tools"] = toolbox.to_dict()
+        if deadline is not None:
+            kwargs["deadline"] = deadline
+        self.history.append(self.provider.parse_user_message(prompt))
+
+        steps = []
+        stop_reason = "done"
+        pool = None
+        try:
+            while True:
+                if steps and deadline is not None and deadline.done:
+                    stop_reason = self.stop_reason(deadline)
+                    break
+
+                model_start = time.perf_counter()
+                try:
+                    response = self.get_response(self.history, **kwargs)
+                except Exception as e:
+                    # sync sdk calls give up with their own timeout error when the deadline runs out
+                    if deadline is None or not deadline.done:
+                        raise
+                    if not steps:
+                        deadline.check()
+                    stop_reason = self.stop_reason(deadline)
+                    break
+                self.history.append(self.provider.parse_response(response))
+                step = ToolStep(model_time=time.perf_counter() - model_start)
+                steps.append(step)
+
+                if not response.tools:
+                    break
+                if len(steps) >= max_steps:
+                    stop_reason = "max_steps"
+                    self.add_skipped_tool_responses(response.tools, stop_reason)
+                    break
+
+                # every tool call of the turn is dispatched at once
+                tool_start = time.perf_counter()
+                if pool is None:
+                    pool = ThreadPoolExecutor(max_workers=max(len(response.tools), 4))
+                futures = [pool.submit(self.run_tool, toolbox, tool_call, deadline) for tool_call in response.tools]
+                not_done = futures
+                while not_done:
+                    # waits in short slices so a cancelled deadline is noticed
+                    _, not_done = wait(not_done, timeout=None if deadline is None else 0.05)
+                    if deadline is not None and deadline.done:
+                        break
+                step.tool_time = time.perf_counter() - tool_start
+                step.tool_calls = response.tools
+                if not_done:
+                    stop_reason = self.stop_reason(deadline)
+
+                for tool_call, future in zip(response.tools, futures):
+                    if future in not_done:
+                        self.add_skipped_tool_responses([tool_call], stop_reason)
+                        continue
+                    result, tool_time = future.result()
+                    step.tool_times.append(tool_time)
+                    self.add_tool_response(tool_call, result)
+                if not_done:
+                    break
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+
+        return ToolRun(response=response, steps=steps, stop_reason=stop_reason, total_time=time.perf_counter() - start)
+
+    async def run_tools_async(self, prompt: Union[str, Prompt], toolbox : ToolBox, max_steps : int = 10, deadline : Union[float, Deadline, None] = None, **kwargs) -> ToolRun:
+        start = time.perf_counter()
+        deadline = as_deadline(deadline)
+
+        prompt, kwargs = self.prep_prompt(prompt, **kwargs)
+        kwargs["tools"] = toolbox.to_dict()
+        if deadline is not None:
+            kwargs["deadline"] = deadline
+        self.history.append(self.provider.parse_user_message(prompt))
+
+        steps = []
+        stop_reason = "done"
+        while True:
+            if steps and deadline is not None and deadline.done:
+                stop_reason = self.stop_reason(deadline)
+                break
+
+            model_start = time.perf_counter()
+            try:
+                response = await self.get_response_async(self.history, **kwargs)
+            except (DeadlineExceeded, Cancelled):
+                if not steps:
+                    raise
+                stop_reason = self.stop_reason(deadline)
+                break
+            self.history.append(self.provider.parse_response(response))
+            step = ToolStep(model_time=time.perf_counter() - model_start)
+            steps.append(step)
+
+            if not response.tools:
+                break
+            if len(steps) >= max_steps:
+                stop_reason = "max_steps"
+                self.add_skipped_tool_responses(response.tools, stop_reason)
+                break
+
+            tool_start = time.perf_counter()
+            tasks = [asyncio.ensure_future(self.run_tool_async(toolbox, tool_call, deadline)) for tool_call in response.tools]
+            try:
+                await run_with_deadline(deadline, asyncio.gather(*tasks))
+            except (DeadlineExceeded, Cancelled):
+                stop_reason = self.stop_reason(deadline)
+            finally:
+                step.tool_time = time.perf_counter() - tool_start
+                step.tool_calls = response.tools
+
+            # tools that finished before the deadline keep their results
+            for tool_call, task in zip(response.tools, tasks):
+                if not task.done() or task.cancelled():
+                    self.add_skipped_tool_responses([tool_call], stop_reason)
+                    continue
+                result, tool_time = task.result()
+                step.tool_times.append(tool_time)
+                self.add_tool_response(tool_call, result)
+            if stop_reason != "done":
+                break
+
+        return ToolRun(response=response, steps=steps, stop_reason=stop_reason, total_time=time.perf_counter() - start)
 
-        return response
-    
     def add_user_message(self, message: str):
         self.history.append(self.provider.parse_user_message(message))
 
@@ -110,11 +387,15 @@ class LLM:
         self.history.append(self.provider.parse_tool_response(tool_response))
 
 class SinglePromptLLM(LLM):
-    def __init__(self, provider: Provider, model : str, prompt : Union[str, Prompt], system_prompt : Optional[Union[str, Prompt]] = None, api_key : Optional[str] = None, **kwargs):
-        super().__init__(provider, model, api_key=api_key, system_prompt=system_prompt)
+    def __init__(self, provider: Provider, model : str, prompt : Union[str, Prompt], system_prompt : Optional[Union[str, Prompt]] = None, api_key : Optional[str] = None,
+                 single_flight : Optional[SingleFlight] = None, cassette : Optional[Cassette] = None, **kwargs):
+        super().__init__(provider, model, api_key=api_key, system_prompt=system_prompt, single_flight=single_flight, cassette=cassette)
         if isinstance(prompt, Prompt):
             prompt = prompt.get(**kwargs)
         self.prompt = prompt
 
     def ask(self, **kwargs):
         return super().ask(self.prompt, **kwargs)
+
+    async def ask_async(self, **kwargs):
+        return await super().ask_async(self.prompt, **kwargs)
@@ -0,0 +1,191 @@
+import bisect
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+from typing import Any, Optional
+
+'''
+# usage
+
+# opt in, from python or with the MUXLLM_PROFILE=1 environment variable
+profiling.enable()
+
+llm.ask("...") # every internal stage of the call is timed
+
+print(profiling.profiler.report()) # count, total and percentiles per stage
+profiling.dump("profile.json")
+
+# then from the command line
+muxllm profile report profile.json
+muxllm profile report profile.json --folded > profile.folded # for flamegraph.pl, speedscope, etc.
+'''
+
+# histogram buckets, from 10 microseconds to ~80 seconds, doubling each time
+BUCKET_BOUNDS = [0.00001 * 2 ** i for i in range(24)]
+
+class Histogram:
+    __slots__ = ("count", "total", "min", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+        # one more bucket for everything above the last bound
+        self.buckets = [0] * (len(BUCKET_BOUNDS) + 1)
+
+    def add(self, seconds : float):
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        self.buckets[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+
+    def percentile(self, p : float) -> float:
+        # upper bound of the bucket the percentile falls in, capped by the largest value seen
+        if self.count == 0:
+            return 0.0
+        target = p / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= target and n:
+                return min(BUCKET_BOUNDS[i], self.max) if i < len(BUCKET_BOUNDS) else self.max
+        return self.max
+
+    def to_dict(self) -> dict[str, Any]:
+        return {"count": self.count, "total": self.total, "min": self.min if self.count else 0.0, "max": self.max, "buckets": self.buckets}
+
+    @classmethod
+    def from_dict(cls, d : dict[str, Any]) -> "Histogram":
+        histogram = cls()
+        histogram.count = d["count"]
+        histogram.total = d["total"]
+        histogram.min = d["min"] if d["count"] else float("inf")
+        histogram.max = d["max"]
+        histogram.buckets = list(d["buckets"])
+        return histogram
+
+class _Frame:
+    __slots__ = ("name", "start", "children")
+
+    def __init__(self, name : str):
+        self.name = name
+        self.start = time.perf_counter()
+        self.children = 0.0
+
+# the stages the current thread / task is in, outermost first
+_stack : contextvars.ContextVar[tuple] = contextvars.ContextVar("muxllm_profiling_stack", default=())
+
+class Profiler:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages : dict[str, Histogram] = {}
+        # self time (excluding child stages) per stack of stage names, which is what flamegraphs are built from
+        self.stacks : dict[tuple[str, ...], float] = {}
+
+    def record(self, stack : tuple[str, ...], seconds : float, self_seconds : float):
+        with self.lock:
+            histogram = self.stages.get(stack[-1])
+            if histogram is None:
+                histogram = self.stages[stack[-1]] = Histogram()
+            histogram.add(seconds)
+            self.stacks[stack] = self.stacks.get(stack, 0.0) + self_seconds
+
+    def reset(self):
+        with self.lock:
+            self.stages = {}
+            self.stacks = {}
+
+    def to_dict(self) -> dict[str, Any]:
+        with self.lock:
+            return {
+                "bucket_bounds": BUCKET_BOUNDS,
+                "stages": {name: histogram.to_dict() for name, histogram in self.stages.items()},
+                "stacks": {";".join(stack): seconds for stack, seconds in self.stacks.items()},
+            }
+
+    @classmethod
+    def from_dict(cls, d : dict[str, Any]) -> "Profiler":
+        profiler = cls()
+        profiler.stages = {name: Histogram.from_dict(histogram) for name, histogram in d["stages"].items()}
+        profiler.stacks = {tuple(stack.split(";")): seconds for stack, seconds in d["stacks"].items()}
+        return profiler
+
+    def dump(self, path : str):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path : str) -> "Profiler":
+        with open(path, "r") as f:
+            return cls.from_dict(json.load(f))
+
+    def report(self) -> str:
+        header = f"{'stage':<28}{'count':>8}{'total ms':>12}{'mean ms':>10}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+        lines = [header, "-" * len(header)]
+        with self.lock:
+            stages = sorted(self.stages.items(), key=lambda item: item[1].total, reverse=True)
+            for name, h in stages:
+                lines.append(f"{name:<28}{h.count:>8}{h.total * 1000:>12.2f}{h.total / h.count * 1000:>10.3f}"
+                             f"{h.percentile(50) * 1000:>10.3f}{h.percentile(90) * 1000:>10.3f}"
+                             f"{h.percentile(99) * 1000:>10.3f}{h.max * 1000:>10.3f}")
+        return "\n".join(lines)
+
+    def folded(self) -> str:
+        # the folded stack format of flamegraph.pl: "outer;inner <microseconds>" per line
+        with self.lock:
+            return "\n".join(f"{';'.join(stack)} {round(seconds * 1_000_000)}" for stack, seconds in sorted(self.stacks.items()))
+
+class _Stage:
+    __slots__ = ("profiler", "name", "frame", "token")
+
+    def __init__(self, profiler : Profiler, name : str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.frame = _Frame(self.name)
+        self.token = _stack.set(_stack.get() + (self.frame,))
+        return self
+
+    def __exit__(self, *args):
+        elapsed = time.perf_counter() - self.frame.start
+        frames = _stack.get()
+        _stack.reset(self.token)
+        if len(frames) > 1:
+            frames[-2].children += elapsed
+        # children running concurrently (e.g. tools in a gather) can add up to more than the parent took
+        self.profiler.record(tuple(frame.name for frame in frames), elapsed, max(elapsed - self.frame.children, 0.0))
+
+profiler = Profiler()
+_enabled = os.environ.get("MUXLLM_PROFILE", "").lower() in ("1", "true", "yes")
+_disabled_stage = contextlib.nullcontext()
+
+def enable():
+    global _enabled
+    _enabled = True
+
+def disable():
+    global _enabled
+    _enabled = False
+
+def is_enabled() -> bool:
+    return _enabled
+
+def stage(name : str):
+    # times the block as a stage of the current call. Costs a single check when profiling is disabled
+    if not _enabled:
+        return _disabled_stage
+    return _Stage(profiler, name)
+
+def dump(path : str):
+    profiler.dump(path)
+
+def report(path : Optional[str] = None, folded : bool = False) -> str:
+    # report of a dumped profile, or of the current one
+    source = Profiler.load(path) if path is not None else profiler
+    return source.folded() if folded else source.report()
@@ -1,4 +1,7 @@
 from pydantic import BaseModel
+from typing import Any
+from muxllm.deadline import pop_deadline, run_with_deadline, iter_with_deadline, aiter_with_deadline, call_with_deadline
+from muxllm.profiling import stage
 import json
 
 class ModelNotAvailable(Exception):
@@ -20,7 +23,22 @@ class LLMResponse(BaseModel):
     message: str | None
     tools: list[ToolCall] | None
 
+class StreamChunk(BaseModel):
+    model: str
+    raw_response: dict | object # raw chunk/event from the provider
+    delta: str | None = None # text added by this chunk
+    message: str = "" # text so far
+    partial: Any = None # structured output parsed so far
+    tools: list[ToolCall] | None = None # tool calls whose arguments were completed by this chunk
+    partial_tools: list[dict] | None = None # every tool call so far, with its partially parsed args
+    done: bool = False
+    response: LLMResponse | None = None # the full response, set on the last chunk
+    parsed: Any = None # the validated structured output, set on the last chunk
+
 class BaseProvider:
+    # max number of texts the provider accepts in one embeddings request, 0 means no limit
+    embed_batch_size = 0
+
     def __init__(self):
         pass
 
@@ -42,8 +60,32 @@ class BaseProvider:
     async def get_response_async(self, messages : list[dict[str, str | dict]], model : str, **kwargs) -> LLMResponse:
         pass
 
-    # def get_response_stream(self, messages : list[dict[str, str]], model : str, **kwargs):
-    #     pass
+    def get_embeddings(self, texts : list[str], model : str, **kwargs) -> list[list[float]]:
+        raise NotImplementedError(f"{type(self).__name__} does not support embeddings")
+
+    async def get_embeddings_async(self, texts : list[str], model : str, **kwargs) -> list[list[float]]:
+        raise NotImplementedError(f"{type(self).__name__} does not support embeddings")
+
+    def embed(self, texts : list[str], model : str, cache = None, max_concurrency : int = 4, **kwargs):
+        try:
+            from muxllm import embeddings
+        except ImportError:
+            raise ValueError("Embeddings require the numpy package to be installed")
+        return embeddings.embed(self, texts, model, cache=cache, max_concurrency=max_concurrency, **kwargs)
+
+    async def embed_async(self, texts : list[str], model : str, cache = None, max_concurrency : int = 4, **kwargs):
+        try:
+            from muxllm import embeddings
+        except ImportError:
+            raise ValueError("Embeddings require the numpy package to be installed")
+        return await embeddings.embed_async(self, texts, model, cache=cache, max_concurrency=max_concurrency, **kwargs)
+
+    def get_response_stream(self, messages : list[dict[str, str | dict]], model : str, **kwargs):
+        raise NotImplementedError(f"{type(self).__name__} does not support streaming")
+
+    async def get_response_stream_async(self, messages : list[dict[str, str | dict]], model : str, **kwargs):
+        raise NotImplementedError(f"{type(self).__name__} does not support streaming")
+        yield # makes this an async generator, like the implementations
 
 class CloudProvider(BaseProvider):
     def __init__(self, model_alias : dict[str, str]):
@@ -95,42 +137,99 @@ class CloudProvider(BaseProvider):
             "content": tool_resp.response
         }
 
+    def call_sync(self, deadline, call):
+        # call(client) with the sync client, which can't be interrupted, so each attempt is bound to the time that is left
+        if deadline is None:
+            return call(self.client)
+        return call_with_deadline(deadline, lambda: call(deadline.bound_client(self.client, max_retries=0)), self.client.max_retries)
+
+    def bound_async_client(self, deadline):
+        return self.async_client if deadline is None else deadline.bound_client(self.async_client)
+
     def get_response(self, messages : list[dict[str, str | dict]], model : str, **kwargs) -> LLMResponse:
         model = self.validate_model(model)
+        deadline = pop_deadline(kwargs)
         
-        response = self.client.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                    **kwargs) 
+        with stage("provider.request"):
+            response = self.call_sync(deadline, lambda client: client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        **kwargs))
         message = response.choices[0].message
 
-        resp = LLMResponse(model=model, raw_response=dict(response), message=message.content, tools=[
-                            ToolCall(id=message.tool_calls[i].id, name=message.tool_calls[i].function.name, args=json.loads(message.tool_calls[i].function.arguments))
-                                for i in range(len(message.tool_calls))] if message.tool_calls else None)
+        with stage("response.parse"):
+            resp = LLMResponse(model=model, raw_response=dict(response), message=message.content, tools=[
+                                ToolCall(id=message.tool_calls[i].id, name=message.tool_calls[i].function.name, args=json.loads(message.tool_calls[i].function.arguments))
+                                    for i in range(len(message.tool_calls))] if message.tool_calls else None)
         return resp
     
     async def get_response_async(self, messages : list[dict[str, str | dict]], model : str, **kwargs) -> LLMResponse:
         model = self.validate_model(model)
+        deadline = pop_deadline(kwargs)
 
-        response = await self.client.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                    **kwargs) 
+        with stage("provider.request"):
+            response = await run_with_deadline(deadline, self.bound_async_client(deadline).chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        **kwargs))
         message = response.choices[0].message
-        resp = LLMResponse(model=model, raw_response=dict(response), message=message.content, tools=[
-                    ToolCall(id=message.tool_calls[i].id, name=message.tool_calls[i].function.name, args=json.loads(message.tool_calls[i].function.arguments))
-                        for i in range(len(message.tool_calls))] if message.tool_calls else None)
+        with stage("response.parse"):
+            resp = LLMResponse(model=model, raw_response=dict(response), message=message.content, tools=[
+                        ToolCall(id=message.tool_calls[i].id, name=message.tool_calls[i].function.name, args=json.loads(message.tool_calls[i].function.arguments))
+                            for i in range(len(message.tool_calls))] if message.tool_calls else None)
         return resp
     
-    # def get_response_stream(self, messages : list[dict[str, str]], model : str, **kwargs):
-    #     model = self.validate_model(model)
-        
-    #     response = self.client.chat.completions.create(
-    #                 model=model,
-    #                 messages=messages,
-    #                 **kwargs) 
-        
-    #     for chunk in response:
-    #         yield LLMResponse(model=model, raw_response=chunk, message=chunk.choices[0].delta.content, tool=chunk.choices[0].delta.tools)
+    def add_stream_event(self, assembler, chunk):
+        if not chunk.choices:
+            return
+        delta = chunk.choices[0].delta
+        assembler.add_text(delta.content)
+        for tool_call in delta.tool_calls or []:
+            function = tool_call.function
+            assembler.tool_delta(tool_call.index, tool_call.id,
+                                 function.name if function else None,
+                                 function.arguments if function else None)
+
+    def get_response_stream(self, messages : list[dict[str, str | dict]], model : str, **kwargs):
+        from muxllm.streaming import StreamAssembler, stream_options, response_model_format
+        model = self.validate_model(model)
+        structured, response_model, kwargs = stream_options(kwargs)
+        if response_model is not None and "response_format" not in kwargs:
+            kwargs["response_format"] = response_model_format(response_model)
+        assembler = StreamAssembler(model, structured, response_model)
+        deadline = pop_deadline(kwargs)
 
+        response = self.call_sync(deadline, lambda client: client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    stream=True,
+                    **kwargs))
+
+        chunk = None
+        for chunk in iter_with_deadline(deadline, response):
+            self.add_stream_event(assembler, chunk)
+            if assembler.has_update():
+                yield assembler.chunk(chunk)
+        yield assembler.finish(chunk)
+
+    async def get_response_stream_async(self, messages : list[dict[str, str | dict]], model : str, **kwargs):
+        from muxllm.streaming import StreamAssembler, stream_options, response_model_format
+        model = self.validate_model(model)
+        structured, response_model, kwargs = stream_options(kwargs)
+        if response_model is not None and "response_format" not in kwargs:
+            kwargs["response_format"] = response_model_format(response_model)
+        assembler = StreamAssembler(model, structured, response_model)
+        deadline = pop_deadline(kwargs)
 
+        response = await run_with_deadline(deadline, self.bound_async_client(deadline).chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    stream=True,
+                    **kwargs))
+
+        chunk = None
+        async for chunk in aiter_with_deadline(deadline, response):
+            self.add_stream_event(assembler, chunk)
+            if assembler.has_update():
+                yield assembler.chunk(chunk)
+        yield assembler.finish(chunk)
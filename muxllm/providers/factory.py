@@ -2,6 +2,8 @@ from enum import Enum
 from muxllm.providers import pfireworks, popenai, pgroq, panthropic, pgoogle
 import importlib # for local provider
 from muxllm.providers.base import CloudProvider
+from muxllm.transport import Cassette
+from typing import Optional
 
 # create an enum for the available providers
 class Provider(str, Enum):
@@ -13,17 +15,17 @@ class Provider(str, Enum):
     local = "local"
 
 # create a factory method to create the correct provider
-def create_provider(provider: Provider, api_key=None) -> CloudProvider:
+def create_provider(provider: Provider, api_key=None, cassette : Optional[Cassette] = None) -> CloudProvider:
     if provider == Provider.openai:
-        return popenai.OpenAIProvider(api_key)
+        return popenai.OpenAIProvider(api_key, cassette=cassette)
     elif provider == Provider.groq:
-        return pgroq.GroqProvider(api_key)
+        return pgroq.GroqProvider(api_key, cassette=cassette)
     elif provider == Provider.fireworks:
-        return pfireworks.FireworksProvider(api_key)
+        return pfireworks.FireworksProvider(api_key, cassette=cassette)
     elif provider == Provider.anthropic:
-        return panthropic.AnthropicProvider(api_key)
+        return panthropic.AnthropicProvider(api_key, cassette=cassette)
     elif provider == Provider.google:
-        return pgoogle.GoogleProvider(api_key)
+        return pgoogle.GoogleProvider(api_key, cassette=cassette)
     elif provider == Provider.local:
         try:
             import llama_cpp
@@ -1,6 +1,9 @@
 import os
 from typing import Optional
 from muxllm.providers.base import CloudProvider, LLMResponse, ToolCall, ToolResponse
+from muxllm.transport import Cassette
+from muxllm.deadline import pop_deadline, run_with_deadline, iter_with_deadline, aiter_with_deadline
+from muxllm.profiling import stage
 import anthropic
 
 model_alias = {
@@ -11,12 +14,16 @@ model_alias = {
 }
 
 class AnthropicProvider(CloudProvider):
-    def __init__(self, api_key : Optional[str] = None):
+    def __init__(self, api_key : Optional[str] = None, cassette : Optional[Cassette] = None):
         super().__init__(model_alias)
         if api_key is None:
             api_key = os.getenv("ANTHROPIC_API_KEY")
-        self.client = anthropic.Anthropic(api_key=api_key)
-        self.async_client = anthropic.AsyncAnthropic(api_key=api_key)
+        if cassette is None:
+            self.client = anthropic.Anthropic(api_key=api_key)
+            self.async_client = anthropic.AsyncAnthropic(api_key=api_key)
+        else:
+            self.client = anthropic.Anthropic(**cassette.client_kwargs(anthropic.DefaultHttpxClient, api_key))
+            self.async_client = anthropic.AsyncAnthropic(**cassette.client_kwargs(anthropic.DefaultAsyncHttpxClient, api_key))
 
     def parse_response(self, response: LLMResponse) -> dict:
         if not response.tools:
@@ -44,40 +51,86 @@ class AnthropicProvider(CloudProvider):
 
     def get_response(self, messages : list[dict[str, str | dict]], model : str, **kwargs) -> LLMResponse:
         model = self.validate_model(model)
+        deadline = pop_deadline(kwargs)
         
-        response = self.client.messages.create(
-                    model=model,
-                    messages=messages,
-                    **kwargs) 
+        with stage("provider.request"):
+            response = self.call_sync(deadline, lambda client: client.messages.create(
+                        model=model,
+                        messages=messages,
+                        **kwargs))
         
-        if response.stop_reason == "tool_use":
-            tool_uses = [block for block in response.content if block.type == "tool_use"]
-            thinking = next(block for block in response.content if block.type == "text")
-            return LLMResponse(model=model, raw_response=dict(response), message=thinking.text, tools=[ToolCall(id=tool_use.id, name=tool_use.name, args=tool_use.input) for tool_use in tool_uses])
-        return LLMResponse(model=model, raw_response=response, message=response.content.text, tools=None)
+        with stage("response.parse"):
+            if response.stop_reason == "tool_use":
+                tool_uses = [block for block in response.content if block.type == "tool_use"]
+                thinking = next(block for block in response.content if block.type == "text")
+                return LLMResponse(model=model, raw_response=dict(response), message=thinking.text, tools=[ToolCall(id=tool_use.id, name=tool_use.name, args=tool_use.input) for tool_use in tool_uses])
+            return LLMResponse(model=model, raw_response=response, message=response.content.text, tools=None)
     
     async def get_response_async(self, messages : list[dict[str, str | dict]], model : str, **kwargs) -> LLMResponse:
         model = self.validate_model(model)
+        deadline = pop_deadline(kwargs)
 
-        response = await self.async_client.messages.create(
-                            model=model,
-                            messages=messages,
-                            **kwargs) 
+        with stage("provider.request"):
+            response = await run_with_deadline(deadline, self.bound_async_client(deadline).messages.create(
+                                model=model,
+                                messages=messages,
+                                **kwargs))
         
-        if response.stop_reason == "tool_use":
-            tool_uses = [block for block in response.content if block.type == "tool_use"]
-            thinking = next(block for block in response.content if block.type == "text")
-            return LLMResponse(model=model, raw_response=dict(response), message=thinking.text, tools=[ToolCall(id=tool_use.id, name=tool_use.name, args=tool_use.input) for tool_use in tool_uses])
-        return LLMResponse(model=model, raw_response=response, message=response.content.text, tools=None)
+        with stage("response.parse"):
+            if response.stop_reason == "tool_use":
+                tool_uses = [block for block in response.content if block.type == "tool_use"]
+                thinking = next(block for block in response.content if block.type == "text")
+                return LLMResponse(model=model, raw_response=dict(response), message=thinking.text, tools=[ToolCall(id=tool_use.id, name=tool_use.name, args=tool_use.input) for tool_use in tool_uses])
+            return LLMResponse(model=model, raw_response=response, message=response.content.text, tools=None)
     
     
-    # def get_response_stream(self, messages : list[dict[str, str]], model : str, **kwargs):
-    #     model = self.validate_model(model)
-        
-    #     response = self.client.messages.stream(
-    #                 model=model,
-    #                 messages=messages,
-    #                 **kwargs) 
-        
-    #     for chunk in response:
-    #         yield LLMResponse(model=model, raw_response=chunk, message=chunk.content.text, tools=chunk.choices[0].message.tools)
\ No newline at end of file
+    def add_stream_event(self, assembler, event):
+        if event.type == "content_block_start" and event.content_block.type == "tool_use":
+            assembler.tool_delta(event.index, event.content_block.id, event.content_block.name)
+        elif event.type == "content_block_delta":
+            if event.delta.type == "text_delta":
+                assembler.add_text(event.delta.text)
+            elif event.delta.type == "input_json_delta":
+                assembler.tool_delta(event.index, arguments=event.delta.partial_json)
+        elif event.type == "content_block_stop":
+            assembler.finish_tool(event.index)
+
+    def get_response_stream(self, messages : list[dict[str, str | dict]], model : str, **kwargs):
+        from muxllm.streaming import StreamAssembler, stream_options
+        model = self.validate_model(model)
+        structured, response_model, kwargs = stream_options(kwargs)
+        assembler = StreamAssembler(model, structured, response_model)
+        deadline = pop_deadline(kwargs)
+
+        response = self.call_sync(deadline, lambda client: client.messages.create(
+                    model=model,
+                    messages=messages,
+                    stream=True,
+                    **kwargs))
+
+        event = None
+        for event in iter_with_deadline(deadline, response):
+            self.add_stream_event(assembler, event)
+            if assembler.has_update():
+                yield assembler.chunk(event)
+        yield assembler.finish(event)
+
+    async def get_response_stream_async(self, messages : list[dict[str, str | dict]], model : str, **kwargs):
+        from muxllm.streaming import StreamAssembler, stream_options
+        model = self.validate_model(model)
+        structured, response_model, kwargs = stream_options(kwargs)
+        assembler = StreamAssembler(model, structured, response_model)
+        deadline = pop_deadline(kwargs)
+
+        response = await run_with_deadline(deadline, self.bound_async_client(deadline).messages.create(
+                            model=model,
+                            messages=messages,
+                            stream=True,
+                            **kwargs))
+
+        event = None
+        async for event in aiter_with_deadline(deadline, response):
+            self.add_stream_event(assembler, event)
+            if assembler.has_update():
+                yield assembler.chunk(event)
+        yield assembler.finish(event)
@@ -1,4 +1,5 @@
 from muxllm.providers.popenai import BaseOpenAIProvider
+from muxllm.transport import Cassette
 from typing import Optional
 import os
 
@@ -15,7 +16,9 @@ model_alias = {
 available_models = [] # empty means that all models are available, mostly because there are far too many models on fireworks
 
 class FireworksProvider(BaseOpenAIProvider):
-    def __init__(self, api_key: Optional[str] = None):
+    embed_batch_size = 256
+
+    def __init__(self, api_key: Optional[str] = None, cassette : Optional[Cassette] = None):
         if api_key is None:
             api_key = os.getenv("FIREWORKS_API_KEY")
-        super().__init__(model_alias, base_url="https://api.fireworks.ai/inference/v1", api_key=api_key)
\ No newline at end of file
+        super().__init__(model_alias, base_url="https://api.fireworks.ai/inference/v1", api_key=api_key, cassette=cassette)
\ No newline at end of file
@@ -2,13 +2,21 @@ import google.generativeai as genai
 import proto
 import os
 from muxllm.providers.base import CloudProvider, LLMResponse, ToolCall, ToolResponse
+from muxllm.transport import Cassette
+from muxllm.deadline import pop_deadline, run_with_deadline, iter_with_deadline, aiter_with_deadline, call_with_deadline
+from muxllm.profiling import stage
 from typing import Optional
 
 model_alias = {}
 
 class GoogleProvider(CloudProvider):
-    def __init__(self, api_key : Optional[str] = None):
+    embed_batch_size = 100
+
+    def __init__(self, api_key : Optional[str] = None, cassette : Optional[Cassette] = None):
         super().__init__(model_alias)
+        if cassette is not None:
+            # the google sdk talks grpc, not httpx, so its requests can't go through a cassette
+            raise ValueError("The google provider does not support cassettes")
         if api_key is None:
             api_key = os.getenv("GOOGLE_API_KEY")
 
@@ -76,15 +84,33 @@ class GoogleProvider(CloudProvider):
             google_proto_tools.append(genai.protos.Tool(google_proto_tool))
         return google_proto_tools
 
-    def get_response(self, messages : list[dict[str, str | dict]], model : str, **kwargs) -> LLMResponse:
+    def get_embeddings(self, texts : list[str], model : str, **kwargs) -> list[list[float]]:
         model = self.validate_model(model)
+        if not model.startswith("models/"):
+            model = "models/" + model
+        deadline = pop_deadline(kwargs)
+        return call_with_deadline(deadline, lambda: genai.embed_content(model=model, content=texts, **self.request_options(deadline, kwargs)))["embedding"]
 
+    async def get_embeddings_async(self, texts : list[str], model : str, **kwargs) -> list[list[float]]:
+        model = self.validate_model(model)
+        if not model.startswith("models/"):
+            model = "models/" + model
+        deadline = pop_deadline(kwargs)
+        response = await run_with_deadline(deadline, genai.embed_content_async(model=model, content=texts, **self.request_options(deadline, kwargs)))
+        return response["embedding"]
+
+    def request_options(self, deadline, kwargs : dict) -> dict:
+        # the google sdk takes its timeout through request_options
+        remaining = deadline.remaining() if deadline is not None else None
+        if remaining is not None:
+            kwargs["request_options"] = {**kwargs.get("request_options", {}), "timeout": remaining}
+        return kwargs
+
+    def get_client(self, messages : list[dict[str, str | dict]], model : str, **kwargs) -> tuple[genai.GenerativeModel, list]:
         google_proto_tools = []
         if "tools" in kwargs:
             google_proto_tools = self.tools_dict_to_google_protos(kwargs["tools"])
-        # google doesnt need tool_choice, delete it if it exists
-        if "tool_choice" in kwargs:
-            del kwargs["tool_choice"]
+        # google doesnt need tool_choice, it is ignored
 
         if messages[0]["role"] == "system":
             system_message = messages[0]["parts"][0]
@@ -92,10 +118,9 @@ class GoogleProvider(CloudProvider):
             messages = messages[1:]
         else:
             client = genai.GenerativeModel(model, tools=google_proto_tools)
+        return client, messages
 
-        response = client.generate_content(messages)
-
-        
+    def parse_google_response(self, response, model : str) -> LLMResponse:
         tools = []
         for part in response.candidates[0].content.parts:
             if fn := part.function_call:
@@ -104,28 +129,69 @@ class GoogleProvider(CloudProvider):
             return LLMResponse(model=model, raw_response=response, message="", tools=tools)
         else:
             return LLMResponse(model=model, raw_response=response, message=response.text, tools=None)
-    
+
+    def get_response(self, messages : list[dict[str, str | dict]], model : str, **kwargs) -> LLMResponse:
+        model = self.validate_model(model)
+        deadline = pop_deadline(kwargs)
+        with stage("google.to_protos"):
+            client, messages = self.get_client(messages, model, **kwargs)
+
+        with stage("provider.request"):
+            response = call_with_deadline(deadline, lambda: client.generate_content(messages, **self.request_options(deadline, {})))
+
+        with stage("response.parse"):
+            return self.parse_google_response(response, model)
+
     async def get_response_async(self, messages : list[dict[str, str | dict]], model : str, **kwargs) -> LLMResponse:
         model = self.validate_model(model)
+        deadline = pop_deadline(kwargs)
+        with stage("google.to_protos"):
+            client, messages = self.get_client(messages, model, **kwargs)
 
-        google_proto_tools = []
-        if "tools" in kwargs:
-            google_proto_tools = self.tools_dict_to_google_protos(kwargs["tools"])
+        with stage("provider.request"):
+            response = await run_with_deadline(deadline, client.generate_content_async(messages, **self.request_options(deadline, {})))
 
-        if messages[0]["role"] == "system":
-            system_message = messages[0]["parts"][0]
-            client = genai.GenerativeModel(model, system_instruction=system_message, tools=google_proto_tools)
-            messages = messages[1:]
-        else:
-            client = genai.GenerativeModel(model, tools=google_proto_tools)
+        with stage("response.parse"):
+            return self.parse_google_response(response, model)
 
-        response = await client.generate_content_async(messages)
-        
-        tools = []
-        for part in response.candidates[0].content.parts:
+    def add_stream_event(self, assembler, chunk):
+        # google sends whole function calls, so they are complete as soon as they arrive
+        if not chunk.candidates:
+            return
+        for part in chunk.candidates[0].content.parts:
             if fn := part.function_call:
-                tools.append(ToolCall(id='', name=fn.name, args={k: v for k, v in fn.args.items()}))
-        if tools:
-            return LLMResponse(model=model, raw_response=response, message="", tools=tools)
-        else:
-            return LLMResponse(model=model, raw_response=response, message=response.text, tools=None)
\ No newline at end of file
+                assembler.add_tool(len(assembler.tool_order), ToolCall(id='', name=fn.name, args={k: v for k, v in fn.args.items()}))
+            elif part.text:
+                assembler.add_text(part.text)
+
+    def get_response_stream(self, messages : list[dict[str, str | dict]], model : str, **kwargs):
+        from muxllm.streaming import StreamAssembler, stream_options
+        model = self.validate_model(model)
+        structured, response_model, kwargs = stream_options(kwargs)
+        assembler = StreamAssembler(model, structured, response_model)
+        deadline = pop_deadline(kwargs)
+        client, messages = self.get_client(messages, model, **kwargs)
+
+        chunk = None
+        response = call_with_deadline(deadline, lambda: client.generate_content(messages, stream=True, **self.request_options(deadline, {})))
+        for chunk in iter_with_deadline(deadline, response):
+            self.add_stream_event(assembler, chunk)
+            if assembler.has_update():
+                yield assembler.chunk(chunk)
+        yield assembler.finish(chunk)
+
+    async def get_response_stream_async(self, messages : list[dict[str, str | dict]], model : str, **kwargs):
+        from muxllm.streaming import StreamAssembler, stream_options
+        model = self.validate_model(model)
+        structured, response_model, kwargs = stream_options(kwargs)
+        assembler = StreamAssembler(model, structured, response_model)
+        deadline = pop_deadline(kwargs)
+        client, messages = self.get_client(messages, model, **kwargs)
+
+        chunk = None
+        response = await run_with_deadline(deadline, client.generate_content_async(messages, stream=True, **self.request_options(deadline, {})))
+        async for chunk in aiter_with_deadline(deadline, response):
+            self.add_stream_event(assembler, chunk)
+            if assembler.has_update():
+                yield assembler.chunk(chunk)
+        yield assembler.finish(chunk)
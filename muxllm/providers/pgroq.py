@@ -1,8 +1,9 @@
-from groq import Groq, AsyncGroq
+from groq import Groq, AsyncGroq, DefaultHttpxClient, DefaultAsyncHttpxClient
 from typing import Optional
 import os
 
 from muxllm.providers.base import CloudProvider
+from muxllm.transport import Cassette
 
 model_alias = {
     "llama3-8b-instruct": "llama3-8b-8192",
@@ -13,9 +14,13 @@ model_alias = {
 }
 
 class GroqProvider(CloudProvider):
-    def __init__(self, api_key : Optional[str] = None):
+    def __init__(self, api_key : Optional[str] = None, cassette : Optional[Cassette] = None):
         super().__init__(model_alias)
         if api_key is None:
             api_key = os.getenv("GROQ_API_KEY")
-        self.client = Groq(api_key=api_key)
-        self.async_client = AsyncGroq(api_key=api_key)
\ No newline at end of file
+        if cassette is None:
+            self.client = Groq(api_key=api_key)
+            self.async_client = AsyncGroq(api_key=api_key)
+        else:
+            self.client = Groq(**cassette.client_kwargs(DefaultHttpxClient, api_key))
+            self.async_client = AsyncGroq(**cassette.client_kwargs(DefaultAsyncHttpxClient, api_key))
\ No newline at end of file
@@ -1,6 +1,8 @@
 import openai, os
 from typing import Optional
 from muxllm.providers.base import CloudProvider
+from muxllm.transport import Cassette
+from muxllm.deadline import pop_deadline, run_with_deadline
 
 model_alias = {
     "gpt-4-turbo" : "gpt-4-turbo-preview",
@@ -8,16 +10,34 @@ model_alias = {
 }
 
 class BaseOpenAIProvider(CloudProvider):
-    def __init__(self, model_alias : dict, base_url : str, api_key : Optional[str] = None):
+    def __init__(self, model_alias : dict, base_url : str, api_key : Optional[str] = None, cassette : Optional[Cassette] = None):
         super().__init__(model_alias)
 
-        self.client = openai.Client(base_url=base_url, api_key=api_key)
-        self.async_client = openai.AsyncClient(base_url=base_url, api_key=api_key)
+        if cassette is None:
+            self.client = openai.Client(base_url=base_url, api_key=api_key)
+            self.async_client = openai.AsyncClient(base_url=base_url, api_key=api_key)
+        else:
+            self.client = openai.Client(base_url=base_url, **cassette.client_kwargs(openai.DefaultHttpxClient, api_key))
+            self.async_client = openai.AsyncClient(base_url=base_url, **cassette.client_kwargs(openai.DefaultAsyncHttpxClient, api_key))
 
-        self.client.chat.completions.create
+    def get_embeddings(self, texts : list[str], model : str, **kwargs) -> list[list[float]]:
+        model = self.validate_model(model)
+        deadline = pop_deadline(kwargs)
+        response = self.call_sync(deadline, lambda client: client.embeddings.create(model=model, input=texts, **kwargs))
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    async def get_embeddings_async(self, texts : list[str], model : str, **kwargs) -> list[list[float]]:
+        model = self.validate_model(model)
+        deadline = pop_deadline(kwargs)
+        response = await run_with_deadline(deadline, self.bound_async_client(deadline).embeddings.create(model=model, input=texts, **kwargs))
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
 
 class OpenAIProvider(BaseOpenAIProvider):
-    def __init__(self, api_key : Optional[str] = None):
+    embed_batch_size = 2048
+
+    def __init__(self, api_key : Optional[str] = None, cassette : Optional[Cassette] = None):
         if api_key is None:
             api_key = os.getenv("OPENAI_API_KEY")
-        super().__init__(model_alias, base_url="https://api.openai.com/v1", api_key=api_key)
+        # OPENAI_BASE_URL allows pointing at a proxy or a mock server, e.g. for load testing
+        base_url = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+        super().__init__(model_alias, base_url=base_url, api_key=api_key, cassette=cassette)
@@ -0,0 +1,505 @@
+import asyncio
+import json
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Optional
+
+from muxllm.deadline import Deadline, DeadlineExceeded, Cancelled, run_with_deadline
+from muxllm.providers.base import CloudProvider, LLMResponse, ToolCall, ToolResponse
+from muxllm.providers.factory import Provider, create_provider
+from muxllm.singleflight import SingleFlight, request_key
+from muxllm.transport import Cassette
+
+'''
+# usage
+
+# from the command line
+muxllm serve --port 8000 --cache-size 1024
+
+# or from python
+gateway = Gateway(cache_size=1024)
+asyncio.run(gateway.serve("127.0.0.1", 8000))
+
+# then point any OpenAI client at it. The model is "<provider>/<model>"
+client = openai.Client(base_url="http://127.0.0.1:8000/v1", api_key="unused")
+client.chat.completions.create(model="groq/llama3-8b-instruct", messages=[...])
+'''
+
+MAX_BODY_SIZE = 8 * 1024 * 1024
+
+STATUS_TEXT = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    499: "Client Closed Request",
+    502: "Bad Gateway",
+    504: "Gateway Timeout",
+}
+
+class HTTPError(Exception):
+    def __init__(self, status : int, message : str, type : str = "invalid_request_error"):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.type = type
+
+class ResponseCache:
+    def __init__(self, max_size : int = 1024, ttl : Optional[float] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries : OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key : str) -> Optional[Any]:
+        entry = self.entries.get(key)
+        if entry is None or (self.ttl is not None and time.monotonic() - entry[0] > self.ttl):
+            self.entries.pop(key, None)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key : str, value : Any):
+        if self.max_size <= 0:
+            return
+        self.entries[key] = (time.monotonic(), value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+class RateLimiter:
+    # token bucket limiting the number of upstream requests per second, plus a cap on concurrent requests
+    def __init__(self, max_concurrency : int = 64, requests_per_second : Optional[float] = None):
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.rate = requests_per_second
+        self.tokens = requests_per_second or 0
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        await self.semaphore.acquire()
+        if self.rate is None:
+            return
+        try:
+            async with self.lock:
+                while True:
+                    now = time.monotonic()
+                    self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    await asyncio.sleep((1 - self.tokens) / self.rate)
+        except BaseException:
+            self.semaphore.release()
+            raise
+
+    def release(self):
+        self.semaphore.release()
+
+class Metrics:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.upstream_errors = 0
+        self.upstream_calls = 0
+        self.in_flight = 0
+        self.latency_sum = 0.0
+        self.latency_count = 0
+
+    def to_prometheus(self, gateway : "Gateway") -> str:
+        lines = [
+            ("muxllm_requests_total", "counter", self.requests),
+            ("muxllm_errors_total", "counter", self.errors),
+            ("muxllm_upstream_calls_total", "counter", self.upstream_calls),
+            ("muxllm_upstream_errors_total", "counter", self.upstream_errors),
+            ("muxllm_cache_hits_total", "counter", gateway.cache.hits),
+            ("muxllm_cache_misses_total", "counter", gateway.cache.misses),
+            ("muxllm_cache_entries", "gauge", len(gateway.cache)),
+            ("muxllm_singleflight_deduplicated_total", "counter", gateway.single_flight.deduplicated),
+            ("muxllm_in_flight_requests", "gauge", self.in_flight),
+            ("muxllm_connections", "gauge", gateway.connections),
+            ("muxllm_request_latency_seconds_sum", "counter", self.latency_sum),
+            ("muxllm_request_latency_seconds_count", "counter", self.latency_count),
+        ]
+        out = []
+        for name, kind, value in lines:
+            out.append(f"# TYPE {name} {kind}")
+            out.append(f"{name} {value}")
+        return "\n".join(out) + "\n"
+
+def _uses_openai_format(provider : CloudProvider) -> bool:
+    return type(provider).parse_response is CloudProvider.parse_response and \
+           type(provider).parse_tool_response is CloudProvider.parse_tool_response
+
+def openai_messages_to_provider(provider : CloudProvider, messages : list[dict]) -> list:
+    # openai compatible providers take the messages as is, others are rebuilt with the provider's own parse_* methods
+    if _uses_openai_format(provider):
+        return messages
+
+    tool_names = {}
+    converted = []
+    for msg in messages:
+        role = msg.get("role")
+        content = msg.get("content") or ""
+        if role == "system":
+            converted.append(provider.parse_system_message(content))
+        elif role == "user":
+            converted.append(provider.parse_user_message(content))
+        elif role == "assistant":
+            tools = None
+            if msg.get("tool_calls"):
+                tools = [ToolCall(id=call["id"], name=call["function"]["name"], args=json.loads(call["function"]["arguments"] or "{}"))
+                         for call in msg["tool_calls"]]
+                tool_names.update({tool.id: tool.name for tool in tools})
+            converted.append(provider.parse_response(LLMResponse(model="", raw_response={}, message=content, tools=tools)))
+        elif role == "tool":
+            name = msg.get("name") or tool_names.get(msg.get("tool_call_id"), "")
+            converted.append(provider.parse_tool_response(ToolResponse(id=msg.get("tool_call_id", ""), name=name, response=content)))
+        else:
+            raise HTTPError(400, f"Unsupported message role {role}")
+    return converted
+
+def _usage(response : LLMResponse) -> Optional[dict]:
+    raw = response.raw_response
+    usage = raw.get("usage") if isinstance(raw, dict) else getattr(raw, "usage", None)
+    if usage is None:
+        return None
+    if hasattr(usage, "model_dump"):
+        usage = usage.model_dump()
+    return usage if isinstance(usage, dict) else None
+
+def _tool_calls(response : LLMResponse) -> list[dict]:
+    return [{
+        "id": tool.id or f"call_{i}",
+        "type": "function",
+        "function": {"name": tool.name, "arguments": json.dumps(tool.args)}
+    } for i, tool in enumerate(response.tools or [])]
+
+def completion_to_openai(response : LLMResponse, model : str) -> dict:
+    message = {"role": "assistant", "content": response.message}
+    if response.tools:
+        message["tool_calls"] = _tool_calls(response)
+    completion = {
+        "id": "chatcmpl-" + uuid.uuid4().hex,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": message,
+            "finish_reason": "tool_calls" if response.tools else "stop",
+        }],
+    }
+    usage = _usage(response)
+    if usage is not None:
+        completion["usage"] = usage
+    return completion
+
+def completion_to_chunks(response : LLMResponse, model : str) -> list[dict]:
+    base = {
+        "id": "chatcmpl-" + uuid.uuid4().hex,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+    }
+    delta = {"role": "assistant", "content": response.message or ""}
+    if response.tools:
+        delta["tool_calls"] = [{"index": i, **call} for i, call in enumerate(_tool_calls(response))]
+    return [
+        {**base, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]},
+        {**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "tool_calls" if response.tools else "stop"}]},
+    ]
+
+class Gateway:
+    def __init__(self, providers : Optional[dict[str, CloudProvider]] = None, api_keys : Optional[dict[str, str]] = None,
+                 cache_size : int = 0, cache_ttl : Optional[float] = None,
+                 max_concurrency : int = 64, requests_per_second : Optional[float] = None, cassette : Optional[Cassette] = None,
+                 request_timeout : Optional[float] = None):
+        # providers and limiters are shared by every connection, so all callers on the node share pools and limits
+        self.providers = dict(providers or {})
+        self.api_keys = api_keys or {}
+        self.cassette = cassette
+        self.cache = ResponseCache(cache_size, cache_ttl)
+        self.single_flight = SingleFlight()
+        self.max_concurrency = max_concurrency
+        self.requests_per_second = requests_per_second
+        # seconds a request may take, including waiting for the rate limiter. Requests are also cancelled when the client disconnects
+        self.request_timeout = request_timeout
+        self.limiters : dict[str, RateLimiter] = {}
+        self.metrics = Metrics()
+        self.connections = 0
+        self.server = None
+
+    def get_provider(self, name : str) -> CloudProvider:
+        if name not in self.providers:
+            try:
+                provider = Provider(name)
+            except ValueError:
+                raise HTTPError(404, f"Provider {name} is not available", "not_found_error")
+            self.providers[name] = create_provider(provider, self.api_keys.get(name), cassette=self.cassette)
+        return self.providers[name]
+
+    def get_limiter(self, name : str) -> RateLimiter:
+        if name not in self.limiters:
+            self.limiters[name] = RateLimiter(self.max_concurrency, self.requests_per_second)
+        return self.limiters[name]
+
+    def split_model(self, model : Any) -> tuple[str, str]:
+        if not isinstance(model, str) or "/" not in model:
+            raise HTTPError(400, "model must be of the form <provider>/<model>, e.g. groq/llama3-8b-instruct")
+        name, model = model.split("/", 1)
+        return name, model
+
+    def prepare(self, body : dict) -> tuple[str, str, CloudProvider, dict, str]:
+        if not isinstance(body.get("messages"), list):
+            raise HTTPError(400, "messages must be a list")
+        name, model = self.split_model(body.get("model"))
+        provider = self.get_provider(name)
+        kwargs = {k: v for k, v in body.items() if k not in ("model", "messages", "stream", "stream_options")}
+        key = request_key(name, model, body["messages"], **kwargs)
+        return name, model, provider, kwargs, key
+
+    async def complete(self, body : dict, deadline : Optional[Deadline] = None) -> LLMResponse:
+        name, model, provider, kwargs, key = self.prepare(body)
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        messages = openai_messages_to_provider(provider, body["messages"])
+
+        # coalesced requests share the upstream call. It isn't bound to any one request's deadline, each request only
+        # stops waiting for it, and the call is cancelled once every request waiting for it is gone
+        async def call():
+            limiter = self.get_limiter(name)
+            await limiter.acquire()
+            self.metrics.upstream_calls += 1
+            try:
+                return await provider.get_response_async(messages, model, **kwargs)
+            except Exception as e:
+                self.metrics.upstream_errors += 1
+                raise HTTPError(502, f"Upstream error: {e}", "upstream_error")
+            finally:
+                limiter.release()
+
+        response = await self.single_flight.do_async(key, call, deadline)
+        self.cache.set(key, response)
+        return response
+
+    async def stream(self, body : dict, writer : asyncio.StreamWriter, keep_alive : bool, deadline : Optional[Deadline] = None):
+        name, model, provider, kwargs, key = self.prepare(body)
+        chunk_base = {
+            "id": "chatcmpl-" + uuid.uuid4().hex,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": body["model"],
+        }
+
+        head = "HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\nTransfer-Encoding: chunked\r\n"
+        head += "Connection: keep-alive\r\n\r\n" if keep_alive else "Connection: close\r\n\r\n"
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            writer.write(head.encode("latin-1"))
+            for chunk in completion_to_chunks(cached, body["model"]):
+                self.write_chunk(writer, f"data: {json.dumps(chunk)}\n\n")
+            self.end_stream(writer)
+            await writer.drain()
+            return
+
+        messages = openai_messages_to_provider(provider, body["messages"])
+        limiter = self.get_limiter(name)
+        await run_with_deadline(deadline, limiter.acquire())
+        self.metrics.upstream_calls += 1
+        started = False
+        tool_index = 0
+        try:
+            async for chunk in provider.get_response_stream_async(messages, model, deadline=deadline, **kwargs):
+                if not started:
+                    writer.write(head.encode("latin-1"))
+                    started = True
+                    self.write_event(writer, chunk_base, {"role": "assistant", "content": ""})
+
+                if chunk.delta:
+                    self.write_event(writer, chunk_base, {"content": chunk.delta})
+                # tool calls are forwarded as soon as their arguments are complete
+                for tool in chunk.tools or []:
+                    call = {"index": tool_index, "id": tool.id or f"call_{tool_index}", "type": "function",
+                            "function": {"name": tool.name, "arguments": json.dumps(tool.args)}}
+                    self.write_event(writer, chunk_base, {"tool_calls": [call]})
+                    tool_index += 1
+                if chunk.done:
+                    finish_reason = "tool_calls" if chunk.response.tools else "stop"
+                    self.write_event(writer, chunk_base, {}, finish_reason)
+                    self.cache.set(key, chunk.response)
+                await writer.drain()
+        except (DeadlineExceeded, Cancelled) as e:
+            if not started:
+                raise
+            self.write_chunk(writer, f"data: {json.dumps({'error': {'message': str(e), 'type': 'timeout_error'}})}\n\n")
+        except Exception as e:
+            self.metrics.upstream_errors += 1
+            if not started:
+                raise HTTPError(502, f"Upstream error: {e}", "upstream_error")
+            self.write_chunk(writer, f"data: {json.dumps({'error': {'message': f'Upstream error: {e}', 'type': 'upstream_error'}})}\n\n")
+        finally:
+            limiter.release()
+
+        self.end_stream(writer)
+        await writer.drain()
+
+    def write_event(self, writer : asyncio.StreamWriter, chunk_base : dict, delta : dict, finish_reason : Optional[str] = None):
+        chunk = {**chunk_base, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+        self.write_chunk(writer, f"data: {json.dumps(chunk)}\n\n")
+
+    def end_stream(self, writer : asyncio.StreamWriter):
+        self.write_chunk(writer, "data: [DONE]\n\n")
+        writer.write(b"0\r\n\r\n")
+
+    async def handle_completion(self, body : dict, writer : asyncio.StreamWriter, keep_alive : bool, deadline : Optional[Deadline] = None):
+        if body.get("stream"):
+            await self.stream(body, writer, keep_alive, deadline)
+            return
+        response = await self.complete(body, deadline)
+        await self.write_json(writer, 200, completion_to_openai(response, body["model"]), keep_alive)
+
+    def write_chunk(self, writer : asyncio.StreamWriter, data : str):
+        raw = data.encode("utf-8")
+        writer.write(f"{len(raw):x}\r\n".encode("latin-1") + raw + b"\r\n")
+
+    async def write_json(self, writer : asyncio.StreamWriter, status : int, payload : Any, keep_alive : bool):
+        await self.write_response(writer, status, json.dumps(payload).encode("utf-8"), "application/json", keep_alive)
+
+    async def write_response(self, writer : asyncio.StreamWriter, status : int, body : bytes, content_type : str, keep_alive : bool):
+        head = f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+        head += f"Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+        head += "Connection: keep-alive\r\n\r\n" if keep_alive else "Connection: close\r\n\r\n"
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+    async def read_request(self, reader : asyncio.StreamReader) -> Optional[tuple[str, str, dict[str, str], bytes]]:
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        try:
+            method, path, _ = request_line.decode("latin-1").split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, "Malformed request line")
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        length = headers.get("content-length", "") or "0"
+        # isdigit alone lets through digits like "²" that int() rejects
+        if not (length.isascii() and length.isdigit()):
+            raise HTTPError(400, "Invalid Content-Length header")
+        length = int(length)
+        if length > MAX_BODY_SIZE:
+            raise HTTPError(413, "Request body too large")
+        body = await reader.readexactly(length) if length else b""
+        return method, path.split("?", 1)[0], headers, body
+
+    async def dispatch(self, method : str, path : str, body : bytes, writer : asyncio.StreamWriter, keep_alive : bool,
+                       deadline : Optional[Deadline] = None):
+        if path == "/health":
+            await self.write_json(writer, 200, {"status": "ok"}, keep_alive)
+        elif path == "/metrics":
+            text = self.metrics.to_prometheus(self).encode("utf-8")
+            await self.write_response(writer, 200, text, "text/plain; version=0.0.4", keep_alive)
+        elif path in ("/v1/chat/completions", "/chat/completions"):
+            if method != "POST":
+                raise HTTPError(405, "Use POST for chat completions")
+            try:
+                payload = json.loads(body or b"{}")
+            except json.JSONDecodeError:
+                raise HTTPError(400, "Request body is not valid JSON")
+            if not isinstance(payload, dict):
+                raise HTTPError(400, "Request body must be a JSON object")
+            await self.handle_completion(payload, writer, keep_alive, deadline)
+        else:
+            raise HTTPError(404, f"No route for {path}", "not_found_error")
+
+    async def handle_connection(self, reader : asyncio.StreamReader, writer : asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            while True:
+                try:
+                    request = await self.read_request(reader)
+                except HTTPError as e:
+                    await self.write_json(writer, e.status, {"error": {"message": e.message, "type": e.type}}, False)
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+                keep_alive = headers.get("connection", "keep-alive").lower() != "close"
+
+                start = time.perf_counter()
+                self.metrics.requests += 1
+                self.metrics.in_flight += 1
+                deadline = Deadline(self.request_timeout)
+                watcher = asyncio.ensure_future(self.watch_disconnect(reader, writer, deadline))
+                try:
+                    await self.dispatch(method, path, body, writer, keep_alive, deadline)
+                except DeadlineExceeded as e:
+                    self.metrics.errors += 1
+                    await self.write_json(writer, 504, {"error": {"message": str(e), "type": "timeout_error"}}, keep_alive)
+                except Cancelled:
+                    # the client is gone, there is no one to answer
+                    self.metrics.errors += 1
+                    break
+                except HTTPError as e:
+                    self.metrics.errors += 1
+                    await self.write_json(writer, e.status, {"error": {"message": e.message, "type": e.type}}, keep_alive)
+                except Exception as e:
+                    self.metrics.errors += 1
+                    await self.write_json(writer, 500, {"error": {"message": str(e), "type": "server_error"}}, keep_alive)
+                finally:
+                    watcher.cancel()
+                    self.metrics.in_flight -= 1
+                    self.metrics.latency_sum += time.perf_counter() - start
+                    self.metrics.latency_count += 1
+
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def watch_disconnect(self, reader : asyncio.StreamReader, writer : asyncio.StreamWriter, deadline : Deadline):
+        # cancels the request when the client closes the connection, so abandoned requests don't hold on to
+        # upstream connections and rate limits. Pipelined requests are rare enough that polling the connection is fine
+        while not deadline.done:
+            if reader.at_eof() or writer.is_closing():
+                deadline.cancel()
+                return
+            await asyncio.sleep(0.1)
+
+    async def start(self, host : str = "127.0.0.1", port : int = 8000, backlog : int = 1024):
+        self.server = await asyncio.start_server(self.handle_connection, host, port, backlog=backlog)
+        return self.server
+
+    async def serve(self, host : str = "127.0.0.1", port : int = 8000, backlog : int = 1024):
+        server = await self.start(host, port, backlog)
+        async with server:
+            await server.serve_forever()
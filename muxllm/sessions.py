@@ -0,0 +1,280 @@
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import threading
+import uuid
+import weakref
+from collections import OrderedDict
+from typing import Any, Optional, Union
+
+from muxllm.llm import LLM
+from muxllm.prompt import Prompt
+from muxllm.providers.base import LLMResponse, ToolCall, ToolResponse
+from muxllm.providers.factory import Provider
+from muxllm.singleflight import SingleFlight
+from muxllm.tools import ToolBox
+from muxllm.transport import Cassette
+
+'''
+# usage
+
+# one provider client, system prompt and tool schema shared by every conversation
+manager = SessionManager(Provider.openai, "gpt-4", system_prompt="You are a helpful assistant",
+                         tools=my_tools, max_sessions=10000, storage_dir="./sessions")
+
+session = manager.session("user-42") # created, or loaded back from storage_dir if it was evicted
+response = session.chat("Hi, what is the weather in Paris?")
+response = await session.chat_async("And in Rome?")
+
+# idle sessions beyond max_sessions are written to storage_dir and dropped from memory
+manager.flush() # write every resident session, e.g. on shutdown
+'''
+
+def _to_json(message : Any) -> Any:
+    # google history entries are protos, they are stored as the equivalent dicts
+    if isinstance(message, dict):
+        return message
+    if hasattr(message, "model_dump"):
+        return message.model_dump()
+    return type(message).to_dict(message)
+
+class Session:
+    # a handle on one conversation. Only the history is stored per session, everything else lives in the manager.
+    # Turns of a session are serialized, turns of different sessions run concurrently
+    __slots__ = ("manager", "id", "history", "lock", "async_lock", "evicted", "__weakref__")
+
+    def __init__(self, manager : "SessionManager", id : str, history : Optional[list] = None):
+        self.manager = manager
+        self.id = id
+        self.history = history if history is not None else []
+        self.lock = threading.Lock()
+        self.async_lock = None
+        self.evicted = False
+
+    def __repr__(self):
+        return f"Session(id={self.id!r}, messages={len(self.history)})"
+
+    @contextlib.asynccontextmanager
+    async def async_turn(self):
+        # tasks wait on an asyncio lock, the thread lock is polled so a sync turn in another thread doesn't block the loop
+        if self.async_lock is None:
+            self.async_lock = asyncio.Lock()
+        async with self.async_lock:
+            delay = 0.001
+            while not self.lock.acquire(blocking=False):
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 0.05)
+            try:
+                yield
+            finally:
+                self.lock.release()
+
+    def chat(self, prompt : Union[str, Prompt], **kwargs) -> LLMResponse:
+        with self.lock:
+            user_message, messages, kwargs = self.manager.prep_chat(self, prompt, kwargs)
+            response = self.manager.llm.get_response(messages, **kwargs)
+            # the turn is only added to the history once it succeeded
+            self.history.append(user_message)
+            self.history.append(self.manager.llm.provider.parse_response(response))
+        self.manager.evict()
+        return response
+
+    async def chat_async(self, prompt : Union[str, Prompt], **kwargs) -> LLMResponse:
+        async with self.async_turn():
+            user_message, messages, kwargs = self.manager.prep_chat(self, prompt, kwargs)
+            response = await self.manager.llm.get_response_async(messages, **kwargs)
+            self.history.append(user_message)
+            self.history.append(self.manager.llm.provider.parse_response(response))
+        self.manager.evict()
+        return response
+
+    def chat_stream(self, prompt : Union[str, Prompt], **kwargs):
+        with self.lock:
+            user_message, messages, kwargs = self.manager.prep_chat(self, prompt, kwargs)
+            for chunk in self.manager.llm.provider.get_response_stream(messages, self.manager.model, **kwargs):
+                if chunk.done:
+                    self.history.append(user_message)
+                    self.history.append(self.manager.llm.provider.parse_response(chunk.response))
+                yield chunk
+        self.manager.evict()
+
+    async def chat_stream_async(self, prompt : Union[str, Prompt], **kwargs):
+        async with self.async_turn():
+            user_message, messages, kwargs = self.manager.prep_chat(self, prompt, kwargs)
+            async for chunk in self.manager.llm.provider.get_response_stream_async(messages, self.manager.model, **kwargs):
+                if chunk.done:
+                    self.history.append(user_message)
+                    self.history.append(self.manager.llm.provider.parse_response(chunk.response))
+                yield chunk
+        self.manager.evict()
+
+    def add_user_message(self, message : str):
+        with self.lock:
+            self.manager.touch(self)
+            self.history.append(self.manager.llm.provider.parse_user_message(message))
+
+    def add_model_message(self, message : LLMResponse):
+        with self.lock:
+            self.manager.touch(self)
+            self.history.append(self.manager.llm.provider.parse_response(message))
+
+    def add_tool_response(self, tool_call : ToolCall, tool_response : str):
+        tool_response = ToolResponse(id=tool_call.id, name=tool_call.name, response=tool_response)
+        with self.lock:
+            self.manager.touch(self)
+            self.history.append(self.manager.llm.provider.parse_tool_response(tool_response))
+
+    def reset(self):
+        with self.lock:
+            self.manager.touch(self)
+            self.history = []
+
+class SessionManager:
+    def __init__(self, provider : Provider, model : str, api_key : Optional[str] = None, system_prompt : Optional[Union[str, Prompt]] = None,
+                 tools : Optional[Union[ToolBox, list[dict]]] = None, max_sessions : Optional[int] = None, storage_dir : Optional[str] = None,
+                 single_flight : Optional[SingleFlight] = None, cassette : Optional[Cassette] = None):
+        self.llm = LLM(provider, model, api_key=api_key, single_flight=single_flight, cassette=cassette)
+        self.model = model
+        # compiled once, instead of once per session or per call
+        if isinstance(system_prompt, Prompt):
+            system_prompt = system_prompt.get()
+        self.system_message = self.llm.provider.parse_system_message(system_prompt) if system_prompt else None
+        self.tools = tools.to_dict() if isinstance(tools, ToolBox) else tools
+
+        # sessions beyond max_sessions are evicted, least recently used first. Evicted sessions are written to
+        # storage_dir (or dropped if there is none) and loaded back when they are asked for again
+        self.max_sessions = max_sessions
+        self.storage_dir = storage_dir
+        if storage_dir is not None:
+            os.makedirs(storage_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.sessions : OrderedDict[str, Session] = OrderedDict()
+        # evicted sessions that someone still holds a handle on, so a handle and a reload never diverge
+        self.evicted_sessions : weakref.WeakValueDictionary[str, Session] = weakref.WeakValueDictionary()
+        self.evictions = 0
+        self.loads = 0
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def session_path(self, session_id : str) -> str:
+        # ids can be any string, the file name is a hash of it
+        return os.path.join(self.storage_dir, hashlib.sha256(session_id.encode("utf-8")).hexdigest()[:32] + ".json")
+
+    def read_session(self, session_id : str) -> Optional[list]:
+        if self.storage_dir is None:
+            return None
+        try:
+            with open(self.session_path(session_id), "r") as f:
+                return json.load(f)["history"]
+        except FileNotFoundError:
+            return None
+
+    def write_session(self, session : Session):
+        path = self.session_path(session.id)
+        with open(path + ".tmp", "w") as f:
+            json.dump({"id": session.id, "history": [_to_json(message) for message in session.history]}, f)
+        os.replace(path + ".tmp", path)
+
+    def session(self, session_id : Optional[str] = None) -> Session:
+        if session_id is None:
+            session_id = uuid.uuid4().hex
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is not None:
+                self.sessions.move_to_end(session_id)
+                return session
+            session = self.evicted_sessions.pop(session_id, None)
+            if session is not None:
+                session.evicted = False
+            else:
+                history = self.read_session(session_id)
+                if history is not None:
+                    self.loads += 1
+                session = Session(self, session_id, history)
+            self.sessions[session_id] = session
+        self.evict()
+        return session
+
+    def touch(self, session : Session):
+        # marks the session as recently used, bringing it back if it was evicted while its handle was kept
+        with self.lock:
+            if session.evicted:
+                session.evicted = False
+                self.evicted_sessions.pop(session.id, None)
+                self.sessions[session.id] = session
+            else:
+                self.sessions.move_to_end(session.id)
+
+    def evict(self):
+        if self.max_sessions is None:
+            return
+        victims = []
+        with self.lock:
+            excess = len(self.sessions) - self.max_sessions
+            if excess <= 0:
+                return
+            # sessions in the middle of a turn are not idle, they are skipped
+            for session in self.sessions.values():
+                if len(victims) == excess:
+                    break
+                if not session.lock.locked():
+                    victims.append(session)
+            for session in victims:
+                del self.sessions[session.id]
+                session.evicted = True
+                self.evicted_sessions[session.id] = session
+            self.evictions += len(victims)
+
+        if self.storage_dir is None:
+            return
+        for session in victims:
+            with session.lock:
+                # skip sessions that were brought back while waiting for the lock
+                if session.evicted:
+                    self.write_session(session)
+
+    def delete(self, session_id : str):
+        with self.lock:
+            session = self.sessions.pop(session_id, None) or self.evicted_sessions.get(session_id)
+            if session is not None:
+                # a handle that is still held starts over as an empty session, registered again when it is used
+                session.history = []
+                session.evicted = True
+                self.evicted_sessions[session_id] = session
+        if self.storage_dir is not None:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self.session_path(session_id))
+
+    def flush(self):
+        # writes every resident session to storage_dir, they stay in memory
+        if self.storage_dir is None:
+            raise ValueError("SessionManager has no storage_dir to flush to")
+        with self.lock:
+            sessions = list(self.sessions.values())
+        for session in sessions:
+            with session.lock:
+                self.write_session(session)
+
+    def prep_chat(self, session : Session, prompt : Union[str, Prompt], kwargs : dict) -> tuple[Any, list, dict]:
+        # called with the session lock held
+        self.touch(session)
+        prompt, kwargs = self.llm.prep_prompt(prompt, **kwargs)
+        kwargs = self.llm.prep_tools(kwargs)
+        if self.tools is not None and "tools" not in kwargs:
+            kwargs["tools"] = self.tools
+        user_message = self.llm.provider.parse_user_message(prompt)
+        messages = [self.system_message] if self.system_message is not None else []
+        messages.extend(session.history)
+        messages.append(user_message)
+        return user_message, messages, kwargs
+
+    def stats(self) -> dict[str, int]:
+        with self.lock:
+            return {
+                "resident": len(self.sessions),
+                "evictions": self.evictions,
+                "loads": self.loads,
+            }
@@ -0,0 +1,174 @@
+import asyncio
+import contextvars
+import hashlib
+import json
+import threading
+from typing import Any, Awaitable, Callable, Optional
+from muxllm.deadline import Deadline, run_with_deadline
+
+'''
+# usage
+
+flight = SingleFlight()
+
+# any LLM sharing this SingleFlight will share upstream calls for identical requests
+llm = LLM(Provider.openai, "gpt-4", single_flight=flight)
+
+# concurrently from many threads / tasks
+llm.ask("What is the capital of France?")
+
+print(flight.deduplicated) # number of upstream calls that were avoided
+'''
+
+# kwargs that control how a call is made, not what is asked. They are left out of the key
+IGNORED_KWARGS = {"deadline", "timeout"}
+
+def _default(obj):
+    # google protos, pydantic models etc. are not json serializable
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    return str(obj)
+
+def request_key(provider : str, model : str, messages : list, **kwargs) -> str:
+    payload = {
+        "provider": provider,
+        "model": model,
+        "messages": messages,
+        "kwargs": {k: v for k, v in kwargs.items() if k not in IGNORED_KWARGS},
+    }
+    raw = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=_default)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.task : Optional[asyncio.Task] = None
+        self.waiters = 0
+        # bounds a sync shared call, which can't be cancelled like a task
+        self.deadline = Deadline()
+
+    def join(self, deadline : Optional[Deadline]):
+        # the shared sync call may run until the last of its waiters' deadlines, and without a limit if one has none
+        if deadline is None or deadline.expires_at is None:
+            self.deadline.expires_at = None
+        elif self.waiters == 0:
+            self.deadline.expires_at = deadline.expires_at
+        elif self.deadline.expires_at is not None:
+            self.deadline.expires_at = max(self.deadline.expires_at, deadline.expires_at)
+        self.waiters += 1
+
+class SingleFlight:
+    # the deadline given to do / do_async only bounds how long that caller waits, so a caller that gives up early doesn't
+    # take the shared call down for the others. The shared call is stopped once every caller has given up
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls : dict[str, _Call] = {}
+        self.async_calls : dict[tuple[int, str], _Call] = {}
+        self.calls_made = 0
+        self.deduplicated = 0
+
+    def do(self, key : str, fn : Callable[[Deadline], Any], deadline : Optional[Deadline] = None) -> Any:
+        # fn(deadline) makes the shared call, and should give up when that deadline does
+        if deadline is not None:
+            deadline.check()
+        with self.lock:
+            call = self.calls.get(key)
+            if call is not None:
+                self.deduplicated += 1
+                leader = False
+            else:
+                call = _Call()
+                self.calls[key] = call
+                self.calls_made += 1
+                leader = True
+            call.join(deadline)
+
+        if leader:
+            if deadline is None:
+                # this caller waits for the result anyway, so the call runs in its thread
+                self.run(key, call, fn)
+            else:
+                # in its own thread, so this caller can stop waiting when its deadline is up
+                context = contextvars.copy_context()
+                threading.Thread(target=context.run, args=(self.run, key, call, fn), daemon=True).start()
+
+        try:
+            if deadline is None:
+                call.done.wait()
+            else:
+                # wake up now and then so a cancelled deadline is noticed
+                while not call.done.wait(0.05):
+                    deadline.check()
+        finally:
+            with self.lock:
+                call.waiters -= 1
+                abandoned = call.waiters == 0 and not call.done.is_set()
+                if abandoned and self.calls.get(key) is call:
+                    del self.calls[key]
+            if abandoned:
+                # every caller gave up, nobody is left to use the result
+                call.deadline.cancel()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def run(self, key : str, call : _Call, fn : Callable[[Deadline], Any]):
+        try:
+            call.result = fn(call.deadline)
+        except BaseException as e:
+            call.error = e
+        finally:
+            with self.lock:
+                if self.calls.get(key) is call:
+                    del self.calls[key]
+            call.done.set()
+
+    async def do_async(self, key : str, fn : Callable[[], Awaitable[Any]], deadline : Optional[Deadline] = None) -> Any:
+        if deadline is not None:
+            deadline.check()
+        # tasks are bound to a loop, so tasks are only coalesced with tasks on the same loop
+        loop = asyncio.get_running_loop()
+        loop_key = (id(loop), key)
+
+        with self.lock:
+            call = self.async_calls.get(loop_key)
+            if call is not None:
+                self.deduplicated += 1
+            else:
+                # the shared call runs in its own task, so cancelling one caller doesn't cancel it for the others
+                call = _Call()
+                call.task = loop.create_task(fn())
+                self.async_calls[loop_key] = call
+                call.task.add_done_callback(lambda task: self.forget(loop_key, call))
+                self.calls_made += 1
+            call.waiters += 1
+
+        try:
+            return await run_with_deadline(deadline, asyncio.shield(call.task))
+        finally:
+            with self.lock:
+                call.waiters -= 1
+                # every caller gave up, nobody is left to use the result
+                abandoned = call.waiters == 0 and not call.task.done()
+                if abandoned and self.async_calls.get(loop_key) is call:
+                    del self.async_calls[loop_key]
+            if abandoned:
+                call.task.cancel()
+
+    def forget(self, loop_key : tuple[int, str], call : _Call):
+        with self.lock:
+            if self.async_calls.get(loop_key) is call:
+                del self.async_calls[loop_key]
+        # avoid "exception was never retrieved" when every caller is gone
+        if not call.task.cancelled():
+            call.task.exception()
+
+    def stats(self) -> dict[str, int]:
+        with self.lock:
+            return {
+                "calls_made": self.calls_made,
+                "deduplicated": self.deduplicated,
+                "in_flight": len(self.calls) + len(self.async_calls),
+            }
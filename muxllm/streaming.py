@@ -0,0 +1,390 @@
+import json
+import re
+from typing import Any, Optional
+
+from muxllm.providers.base import LLMResponse, StreamChunk, ToolCall
+
+'''
+# usage
+
+parser = IncrementalJSONParser()
+parser.feed('{"location": "San Fr')
+parser.partial # {"location": "San Fr"}
+parser.feed('ancisco"}')
+parser.complete # True
+parser.value # {"location": "San Francisco"}
+
+# streaming tool calls, each tool is emitted as soon as its arguments are closed
+for chunk in llm.chat_stream("What is the weather in Paris and in Rome?", tools=my_tools):
+    for tool_call in chunk.tools or []:
+        pool.submit(my_tools.invoke_tool, tool_call)
+'''
+
+MISSING = object()
+
+NUMBER_RE = re.compile(r"-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?")
+STRING_RUN_RE = re.compile(r'[^"\\]*')
+NUMBER_CHARS = set("0123456789+-.eE")
+LITERALS = {"true": True, "false": False, "null": None}
+
+# what the parser expects next
+VALUE, KEY, COLON, AFTER, STRING, NUMBER, LITERAL, DONE = range(8)
+
+def _decode_string(raw : str) -> Any:
+    # decodes the body of a string that may be cut off, dropping a trailing incomplete escape sequence
+    j = raw.rfind("\\", max(0, len(raw) - 6))
+    if j != -1:
+        k = j
+        while k > 0 and raw[k - 1] == "\\":
+            k -= 1
+        # an odd number of backslashes before it means this one is escaped itself
+        step = 6 if raw[j + 1:j + 2] == "u" else 2
+        if (j - k) % 2 == 0 and j + step > len(raw):
+            raw = raw[:j]
+    try:
+        return json.loads('"' + raw + '"')
+    except json.JSONDecodeError:
+        return MISSING
+
+def parse_partial(text : str) -> Any:
+    parser = IncrementalJSONParser()
+    parser.feed(text)
+    return parser.partial
+
+class IncrementalJSONParser:
+    # the parser keeps its place between feeds (the stack of open containers and the scalar being read), so every
+    # character is only looked at once. Closed containers are never changed again, which lets a partial snapshot
+    # share them and only copy the containers that are still open
+    def __init__(self):
+        self.buffer = []
+        self.stack : list[list] = [] # [container, key of the value being read] for each open container
+        self.root = MISSING
+        self.state = VALUE
+        self.scalar = [] # the string / number / literal being read
+        self.is_key = False
+        self.escape = False
+        self.started = False
+        self.complete = False
+        self.error = None
+        self.position = 0
+        self._partial = MISSING
+        self._stale = True
+
+    def feed(self, chunk : str) -> bool:
+        if not chunk:
+            return self.complete
+        self.buffer.append(chunk)
+        self._stale = True
+        if self.error is None and not self.complete:
+            try:
+                self._consume(chunk)
+            except ValueError as e:
+                # reported when the partial value is asked for
+                self.error = e
+        self.position += len(chunk)
+        return self.complete
+
+    def _consume(self, chunk : str):
+        i, n = 0, len(chunk)
+        while i < n:
+            state = self.state
+            if state == STRING:
+                j = i
+                if self.escape:
+                    self.escape = False
+                    j += 1
+                j = STRING_RUN_RE.match(chunk, j).end()
+                if j < n and chunk[j] == "\\":
+                    self.escape = True
+                    j += 1
+                self.scalar.append(chunk[i:j])
+                if j >= n or self.escape:
+                    i = j
+                    continue
+                self._end_string()
+                i = j + 1
+                continue
+
+            c = chunk[i]
+            if state == NUMBER:
+                if c in NUMBER_CHARS:
+                    self.scalar.append(c)
+                    i += 1
+                    continue
+                self._end_number()
+                continue
+            if state == LITERAL:
+                text = "".join(self.scalar) + c
+                if not any(literal.startswith(text) for literal in LITERALS):
+                    raise ValueError(f"Unexpected character {c!r} at position {self.position + i}")
+                self.scalar.append(c)
+                i += 1
+                if text in LITERALS:
+                    self.scalar = []
+                    self._end_value(LITERALS[text], True)
+                continue
+            if c in " \t\n\r":
+                i += 1
+                continue
+            if state == DONE:
+                return
+            self.started = True
+
+            if state == VALUE:
+                if c == "{" or c == "[":
+                    container = {} if c == "{" else []
+                    self._place(container)
+                    self.stack.append([container, None])
+                    self.state = KEY if c == "{" else VALUE
+                elif c == "]" and self.stack and isinstance(self.stack[-1][0], list):
+                    self._close()
+                elif c == '"':
+                    self.state, self.is_key = STRING, False
+                elif c == "-" or c.isdigit():
+                    self.state, self.scalar = NUMBER, [c]
+                elif c in "tfn":
+                    self.state, self.scalar = LITERAL, [c]
+                elif c == "," and self.stack:
+                    pass
+                else:
+                    raise ValueError(f"Unexpected character {c!r} at position {self.position + i}")
+            elif state == KEY:
+                if c == '"':
+                    self.state, self.is_key = STRING, True
+                elif c == "}":
+                    self._close()
+                elif c != ",":
+                    raise ValueError(f"Expected a key at position {self.position + i}")
+            elif state == COLON:
+                if c != ":":
+                    raise ValueError(f"Expected ':' at position {self.position + i}")
+                self.state = VALUE
+            elif state == AFTER:
+                if c == ",":
+                    self.state = KEY if isinstance(self.stack[-1][0], dict) else VALUE
+                elif c in "}]":
+                    self._close()
+                else:
+                    raise ValueError(f"Expected ',' at position {self.position + i}")
+            i += 1
+
+    def _place(self, value : Any):
+        if not self.stack:
+            self.root = value
+            return
+        container, key = self.stack[-1]
+        if isinstance(container, dict):
+            container[key] = value
+        else:
+            container.append(value)
+
+    def _end_value(self, value : Any, closed : bool):
+        self._place(value)
+        if self.stack:
+            self.state = AFTER
+        else:
+            # scalars at the top level have no closing character, so a number is never known to be complete
+            self.state = DONE
+            self.complete = closed
+
+    def _close(self):
+        self.stack.pop()
+        if self.stack:
+            self.state = AFTER
+        else:
+            self.state = DONE
+            self.complete = True
+
+    def _end_string(self):
+        raw = "".join(self.scalar)
+        self.scalar = []
+        value = json.loads('"' + raw + '"')
+        if self.is_key:
+            self.stack[-1][1] = value
+            self.state = COLON
+        else:
+            self._end_value(value, True)
+
+    def _end_number(self):
+        text = "".join(self.scalar)
+        self.scalar = []
+        if NUMBER_RE.fullmatch(text) is None:
+            raise ValueError(f"Invalid number {text!r}")
+        self._end_value(json.loads(text), False)
+
+    def _pending(self) -> Any:
+        # the scalar that is still being read, as far as it got
+        if self.state == STRING and not self.is_key:
+            return _decode_string("".join(self.scalar))
+        if self.state == NUMBER:
+            match = NUMBER_RE.match("".join(self.scalar))
+            return json.loads(match.group()) if match else MISSING
+        return MISSING
+
+    def _snapshot(self) -> Any:
+        if not self.stack:
+            value = self._pending() if self.root is MISSING else self.root
+            return None if value is MISSING else value
+
+        value, replace = self._pending(), False
+        for container, key in reversed(self.stack):
+            copy = container.copy()
+            if value is not MISSING:
+                if isinstance(copy, dict):
+                    copy[key] = value
+                elif replace:
+                    copy[-1] = value
+                else:
+                    copy.append(value)
+            # the open container was placed in its parent when it started, the copy replaces it
+            value, replace = copy, True
+        return value
+
+    def get_text(self) -> str:
+        if len(self.buffer) > 1:
+            self.buffer = ["".join(self.buffer)]
+        return self.buffer[0] if self.buffer else ""
+
+    @property
+    def partial(self) -> Any:
+        if self.error is not None:
+            raise self.error
+        if self._stale:
+            self._partial = self._snapshot()
+            self._stale = False
+        return self._partial
+
+    @property
+    def value(self) -> Any:
+        # scalars at the top level have no closing character, so they are only known to be done at the end of the stream
+        text = self.get_text().strip()
+        return json.loads(text) if text else None
+
+class _ToolState:
+    def __init__(self, id : str = "", name : str = ""):
+        self.id = id
+        self.name = name
+        self.parser = IncrementalJSONParser()
+        self.emitted = False
+        self.tool_call = None
+
+    def to_tool_call(self) -> ToolCall:
+        args = self.parser.value if self.parser.started else {}
+        return ToolCall(id=self.id, name=self.name, args=args or {})
+
+class StreamAssembler:
+    # provider independent state of a streamed response. Providers translate their stream events
+    # into add_text / tool_delta / finish_tool calls and yield the chunk built after each event
+    def __init__(self, model : str, structured : bool = False, response_model : Optional[type] = None):
+        self.model = model
+        self.structured = structured or response_model is not None
+        self.response_model = response_model
+        self.text = []
+        self.content_parser = IncrementalJSONParser() if self.structured else None
+        self.tool_states : dict[Any, _ToolState] = {}
+        self.tool_order : list[Any] = []
+        self.delta = ""
+        self.ready : list[ToolCall] = []
+
+    def add_text(self, text : Optional[str]):
+        if not text:
+            return
+        self.text.append(text)
+        self.delta += text
+        if self.content_parser is not None:
+            self.content_parser.feed(text)
+
+    def tool_delta(self, index : Any, id : Optional[str] = None, name : Optional[str] = None, arguments : Optional[str] = None):
+        state = self.tool_states.get(index)
+        if state is None:
+            state = self.tool_states[index] = _ToolState()
+            self.tool_order.append(index)
+        if id:
+            state.id = id
+        if name:
+            state.name = name
+        if arguments and not state.emitted:
+            if state.parser.feed(arguments):
+                self.finish_tool(index)
+
+    def add_tool(self, index : Any, tool_call : ToolCall):
+        # for providers that send whole tool calls at once
+        state = self.tool_states[index] = _ToolState(tool_call.id, tool_call.name)
+        self.tool_order.append(index)
+        state.emitted = True
+        state.tool_call = tool_call
+        self.ready.append(tool_call)
+
+    def finish_tool(self, index : Any):
+        state = self.tool_states.get(index)
+        if state is None or state.emitted:
+            return
+        state.emitted = True
+        state.tool_call = state.to_tool_call()
+        self.ready.append(state.tool_call)
+
+    def message(self) -> str:
+        if len(self.text) > 1:
+            self.text = ["".join(self.text)]
+        return self.text[0] if self.text else ""
+
+    def partial_tools(self) -> Optional[list[dict]]:
+        if not self.tool_order:
+            return None
+        tools = []
+        for index in self.tool_order:
+            state = self.tool_states[index]
+            args = state.tool_call.args if state.emitted else state.parser.partial
+            tools.append({"id": state.id, "name": state.name, "args": args or {}, "complete": state.emitted})
+        return tools
+
+    def has_update(self) -> bool:
+        return bool(self.delta or self.ready)
+
+    def chunk(self, raw_response : Any) -> StreamChunk:
+        chunk = StreamChunk(model=self.model, raw_response=raw_response, delta=self.delta or None, message=self.message(),
+                            partial=self.content_parser.partial if self.content_parser is not None and self.delta else None,
+                            tools=self.ready or None, partial_tools=self.partial_tools())
+        self.delta = ""
+        self.ready = []
+        return chunk
+
+    def finish(self, raw_response : Any) -> StreamChunk:
+        for index in self.tool_order:
+            self.finish_tool(index)
+        tools = [self.tool_states[index].tool_call for index in self.tool_order]
+        response = LLMResponse(model=self.model, raw_response=raw_response, message=self.message(), tools=tools or None)
+
+        parsed = None
+        if self.content_parser is not None and response.message:
+            parsed = self.content_parser.value
+            if self.response_model is not None:
+                parsed = self.response_model.model_validate(parsed)
+
+        chunk = self.chunk(raw_response)
+        chunk.done = True
+        chunk.response = response
+        chunk.parsed = parsed
+        if self.content_parser is not None and response.message:
+            chunk.partial = self.content_parser.partial
+        return chunk
+
+def stream_options(kwargs : dict) -> tuple[bool, Optional[type], dict]:
+    # pops the muxllm only streaming options out of the kwargs that are sent to the provider
+    kwargs = dict(kwargs)
+    response_model = kwargs.pop("response_model", None)
+    structured = kwargs.pop("structured", False)
+    response_format = kwargs.get("response_format")
+    if isinstance(response_format, dict) and response_format.get("type") in ("json_object", "json_schema"):
+        structured = True
+    return structured, response_model, kwargs
+
+def response_model_format(response_model : type) -> dict:
+    # openai style response_format for a pydantic model
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": response_model.__name__,
+            "schema": response_model.model_json_schema(),
+        }
+    }
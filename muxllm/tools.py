@@ -1,5 +1,10 @@
-from typing import Any
-from muxllm.providers.base import ToolCall
+from typing import Any, Optional
+from pydantic import BaseModel
+from muxllm.providers.base import ToolCall, LLMResponse
+from muxllm.deadline import Deadline, run_with_deadline
+from muxllm.profiling import stage
+import asyncio
+import inspect
 
 class ToolBox:
     def __init__(self):
@@ -11,15 +16,31 @@ class ToolBox:
     def get_tool(self, name: str):
         return self.tools.get(name)
     
-    def invoke_tool(self, tool_call: ToolCall):
+    def invoke_tool(self, tool_call: ToolCall, deadline: Optional[Deadline] = None):
+        # tools that take a deadline argument are given the deadline of the call, so they can stop early
         tool = self.get_tool(tool_call.name)
         if tool:
-            return tool(**tool_call.args)
+            if deadline is not None:
+                deadline.check()
+            return tool(**tool.call_args(tool_call, deadline))
         else:
             return None
+
+    async def invoke_tool_async(self, tool_call: ToolCall, deadline: Optional[Deadline] = None):
+        # coroutine functions are awaited, plain functions are run in a thread so they don't block the loop
+        tool = self.get_tool(tool_call.name)
+        if tool is None:
+            return None
+        args = tool.call_args(tool_call, deadline)
+        if inspect.iscoroutinefunction(tool.function):
+            return await run_with_deadline(deadline, tool(**args))
+        if deadline is not None:
+            deadline.check()
+        return await asyncio.to_thread(tool, **args)
         
     def to_dict(self) -> dict[str, Any]:
-        return [tool.to_dict() for tool in self.tools.values()]
+        with stage("tools.to_dict"):
+            return [tool.to_dict() for tool in self.tools.values()]
     
     def __add__(self, other):
         new_toolbox = ToolBox()
@@ -50,6 +71,15 @@ class Tool:
         self.description = description
         self.parameters = parameters
         self.function = function
+        try:
+            self.accepts_deadline = "deadline" in inspect.signature(function).parameters
+        except (TypeError, ValueError):
+            self.accepts_deadline = False
+
+    def call_args(self, tool_call: ToolCall, deadline: Optional[Deadline] = None) -> dict[str, Any]:
+        if self.accepts_deadline and deadline is not None:
+            return {**tool_call.args, "deadline": deadline}
+        return tool_call.args
 
     def to_dict(self) -> dict[str, Any]:
         return {
@@ -76,4 +106,24 @@ def tool(name: str,
         tool = Tool(name, description, parameters, func)
         toolBox.add_tool(tool)
         return func
-    return decorator
\ No newline at end of file
+    return decorator
+
+class ToolStep(BaseModel):
+    model_time: float # seconds spent waiting for the model
+    tool_time: float = 0 # wall clock seconds spent running this step's tools (concurrently)
+    tool_calls: list[ToolCall] = []
+    tool_times: list[float] = [] # seconds spent in each tool
+
+class ToolRun(BaseModel):
+    response: LLMResponse # the last response from the model
+    steps: list[ToolStep]
+    stop_reason: str # "done", "max_steps", "deadline" or "cancelled"
+    total_time: float
+
+    @property
+    def model_time(self) -> float:
+        return sum(step.model_time for step in self.steps)
+
+    @property
+    def tool_time(self) -> float:
+        return sum(step.tool_time for step in self.steps)
@@ -0,0 +1,287 @@
+import base64
+import functools
+import gzip
+import hashlib
+import importlib
+import json
+import os
+import threading
+import time
+import asyncio
+from typing import Any, Optional
+
+'''
+# usage
+
+# record every request/response pair (including streams) made by the provider's client
+cassette = Cassette("./cassettes/translate.jsonl.gz", mode="record")
+llm = LLM(Provider.openai, "gpt-4", cassette=cassette)
+llm.ask("Translate 'Hola, como estas?' to english")
+
+# replay them later without network access or api keys
+cassette = Cassette("./cassettes/translate.jsonl.gz", mode="replay") # latency=1.0 replays the recorded timings
+llm = LLM(Provider.openai, "gpt-4", cassette=cassette)
+llm.ask("Translate 'Hola, como estas?' to english")
+'''
+
+# headers that describe the original connection, not the response
+DROPPED_HEADERS = {"transfer-encoding", "connection", "keep-alive"}
+
+class CassetteMiss(Exception):
+    pass
+
+def _httpx(obj) -> Any:
+    # the sdks don't all use the same httpx package (or version), so the one the request came from is used
+    return importlib.import_module(type(obj).__module__.split(".")[0])
+
+@functools.lru_cache(maxsize=None)
+def _stream_classes(httpx_module) -> tuple[type, type, type, type]:
+    class ReplayStream(httpx_module.SyncByteStream):
+        def __init__(self, chunks : list[bytes], delays : list[float]):
+            self.chunks = chunks
+            self.delays = delays
+
+        def __iter__(self):
+            for chunk, delay in zip(self.chunks, self.delays):
+                if delay > 0:
+                    time.sleep(delay)
+                yield chunk
+
+    class AsyncReplayStream(httpx_module.AsyncByteStream):
+        def __init__(self, chunks : list[bytes], delays : list[float]):
+            self.chunks = chunks
+            self.delays = delays
+
+        async def __aiter__(self):
+            for chunk, delay in zip(self.chunks, self.delays):
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                yield chunk
+
+    class RecordingStream(httpx_module.SyncByteStream):
+        def __init__(self, stream, on_close):
+            self.stream = stream
+            self.on_close = on_close
+            self.chunks = []
+            self.offsets = []
+            self.start = time.perf_counter()
+
+        def __iter__(self):
+            for chunk in self.stream:
+                self.chunks.append(chunk)
+                self.offsets.append(time.perf_counter() - self.start)
+                yield chunk
+
+        def close(self):
+            self.stream.close()
+            if self.on_close is not None:
+                self.on_close(self.chunks, self.offsets)
+                self.on_close = None
+
+    class AsyncRecordingStream(httpx_module.AsyncByteStream):
+        def __init__(self, stream, on_close):
+            self.stream = stream
+            self.on_close = on_close
+            self.chunks = []
+            self.offsets = []
+            self.start = time.perf_counter()
+
+        async def __aiter__(self):
+            async for chunk in self.stream:
+                self.chunks.append(chunk)
+                self.offsets.append(time.perf_counter() - self.start)
+                yield chunk
+
+        async def aclose(self):
+            await self.stream.aclose()
+            if self.on_close is not None:
+                self.on_close(self.chunks, self.offsets)
+                self.on_close = None
+
+    return ReplayStream, AsyncReplayStream, RecordingStream, AsyncRecordingStream
+
+def request_key(method : str, url : str, body : bytes) -> str:
+    # json bodies are compared by content, so key order doesn't matter. Headers (and api keys) are not part of the key
+    try:
+        body = json.dumps(json.loads(body), sort_keys=True, separators=(",", ":")).encode("utf-8")
+    except (ValueError, UnicodeDecodeError):
+        pass
+    return hashlib.sha256(method.upper().encode("utf-8") + b" " + url.encode("utf-8") + b"\n" + body).hexdigest()
+
+def _encode(chunks : list[bytes]) -> tuple[list[str], bool]:
+    try:
+        return [chunk.decode("utf-8") for chunk in chunks], False
+    except UnicodeDecodeError:
+        return [base64.b64encode(chunk).decode("ascii") for chunk in chunks], True
+
+def _decode(chunks : list[str], b64 : bool) -> list[bytes]:
+    if b64:
+        return [base64.b64decode(chunk) for chunk in chunks]
+    return [chunk.encode("utf-8") for chunk in chunks]
+
+class Cassette:
+    # a file of recorded request/response pairs, one json object per line (gzip compressed if the path ends in .gz)
+    def __init__(self, path : str, mode : str = "replay", latency : float = 0.0, transport = None, async_transport = None):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Cassette mode must be record or replay, got {mode}")
+        self.path = path
+        self.mode = mode
+        # in replay mode, the recorded timings are multiplied by latency. 0 replays at full speed, 1 replays at the recorded speed
+        self.latency = latency
+        # the transports requests are sent to while recording, by default the real network
+        self.transport = transport
+        self.async_transport = async_transport
+        self.lock = threading.Lock()
+        self.interactions : dict[str, list[dict]] = {}
+        self.played : dict[str, int] = {}
+
+        if mode == "replay":
+            self.load()
+        else:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            # start a new recording
+            with self.open("w"):
+                pass
+
+    def open(self, mode : str):
+        if self.path.endswith(".gz"):
+            return gzip.open(self.path, mode + "t", encoding="utf-8")
+        return open(self.path, mode, encoding="utf-8")
+
+    def load(self):
+        with self.open("r") as f:
+            for line in f:
+                if line.strip():
+                    interaction = json.loads(line)
+                    self.interactions.setdefault(interaction["key"], []).append(interaction)
+
+    def __len__(self):
+        return sum(len(interactions) for interactions in self.interactions.values())
+
+    def save_interaction(self, interaction : dict):
+        with self.lock:
+            self.interactions.setdefault(interaction["key"], []).append(interaction)
+            with self.open("a") as f:
+                f.write(json.dumps(interaction, separators=(",", ":")) + "\n")
+
+    def find(self, request) -> dict:
+        key = request_key(request.method, str(request.url), request.content)
+        with self.lock:
+            interactions = self.interactions.get(key)
+            if not interactions:
+                raise CassetteMiss(f"No recorded response for {request.method} {request.url} in {self.path}")
+            # identical requests are replayed in the order they were recorded, then the last one is repeated
+            i = self.played.get(key, 0)
+            self.played[key] = i + 1
+            return interactions[min(i, len(interactions) - 1)]
+
+    def replay_args(self, request) -> tuple[dict, list[bytes], list[float]]:
+        interaction = self.find(request)
+        chunks = _decode(interaction["chunks"], interaction.get("b64", False))
+        offsets = interaction["offsets"]
+        delays = [(offset - prev) * self.latency for prev, offset in zip([0.0] + offsets[:-1], offsets)]
+        return interaction, chunks, delays
+
+    def record_callback(self, request, response, start : float):
+        ttfb = time.perf_counter() - start
+        def on_close(chunks, offsets):
+            encoded, b64 = _encode(chunks)
+            self.save_interaction({
+                "key": request_key(request.method, str(request.url), request.content),
+                "method": request.method,
+                "url": str(request.url),
+                "status": response.status_code,
+                "headers": [[k, v] for k, v in response.headers.multi_items() if k.lower() not in DROPPED_HEADERS],
+                "ttfb": ttfb,
+                "chunks": encoded,
+                "offsets": offsets,
+                "b64": b64,
+            })
+        return on_close
+
+    def handle_request(self, request):
+        httpx = _httpx(request)
+        ReplayStream, _, RecordingStream, _ = _stream_classes(httpx)
+
+        if self.mode == "replay":
+            interaction, chunks, delays = self.replay_args(request)
+            if self.latency > 0:
+                time.sleep(interaction["ttfb"] * self.latency)
+            return httpx.Response(interaction["status"], headers=interaction["headers"],
+                                  stream=ReplayStream(chunks, delays), request=request)
+
+        if self.transport is None:
+            self.transport = httpx.HTTPTransport()
+        start = time.perf_counter()
+        response = self.transport.handle_request(request)
+        headers = [(k, v) for k, v in response.headers.multi_items() if k.lower() not in DROPPED_HEADERS]
+        stream = RecordingStream(response.stream, self.record_callback(request, response, start))
+        return httpx.Response(response.status_code, headers=headers, stream=stream, request=request, extensions=response.extensions)
+
+    async def handle_async_request(self, request):
+        httpx = _httpx(request)
+        _, AsyncReplayStream, _, AsyncRecordingStream = _stream_classes(httpx)
+
+        if self.mode == "replay":
+            interaction, chunks, delays = self.replay_args(request)
+            if self.latency > 0:
+                await asyncio.sleep(interaction["ttfb"] * self.latency)
+            return httpx.Response(interaction["status"], headers=interaction["headers"],
+                                  stream=AsyncReplayStream(chunks, delays), request=request)
+
+        if self.async_transport is None:
+            self.async_transport = httpx.AsyncHTTPTransport()
+        start = time.perf_counter()
+        response = await self.async_transport.handle_async_request(request)
+        headers = [(k, v) for k, v in response.headers.multi_items() if k.lower() not in DROPPED_HEADERS]
+        stream = AsyncRecordingStream(response.stream, self.record_callback(request, response, start))
+        return httpx.Response(response.status_code, headers=headers, stream=stream, request=request, extensions=response.extensions)
+
+    def client_kwargs(self, http_client_cls : type, api_key : Optional[str]) -> dict:
+        # kwargs for an sdk client (openai.Client, anthropic.Anthropic, ...) so every request goes through the cassette.
+        # http_client_cls is the sdk's DefaultHttpxClient or DefaultAsyncHttpxClient
+        is_async = hasattr(http_client_cls, "aclose")
+        transport = _AsyncCassetteTransport(self) if is_async else _CassetteTransport(self)
+        kwargs = {"http_client": http_client_cls(transport=transport)}
+        if self.mode == "replay":
+            # replays are served locally, so there is nothing to retry and no key is needed
+            kwargs["max_retries"] = 0
+            kwargs["api_key"] = api_key or "replay"
+        else:
+            kwargs["api_key"] = api_key
+        return kwargs
+
+class _CassetteTransport:
+    def __init__(self, cassette : Cassette):
+        self.cassette = cassette
+
+    def handle_request(self, request):
+        return self.cassette.handle_request(request)
+
+    def close(self):
+        if self.cassette.transport is not None:
+            self.cassette.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class _AsyncCassetteTransport:
+    def __init__(self, cassette : Cassette):
+        self.cassette = cassette
+
+    async def handle_async_request(self, request):
+        return await self.cassette.handle_async_request(request)
+
+    async def aclose(self):
+        if self.cassette.async_transport is not None:
+            await self.cassette.async_transport.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.aclose()
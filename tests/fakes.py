@@ -0,0 +1,57 @@
+import asyncio
+import threading
+import time
+
+from muxllm import LLM, Provider
+from muxllm.deadline import pop_deadline, run_with_deadline
+from muxllm.providers.base import LLMResponse
+
+class FakeProvider:
+    # stands in for the get_response methods of a provider. respond(messages, model, kwargs) gives the reply, as an
+    # LLMResponse or as the text of the message. Every request is recorded, and like openai a history where a tool call
+    # has no response is rejected
+    def __init__(self, respond=None, delay : float = 0):
+        self.respond = respond or (lambda messages, model, kwargs: "ok")
+        self.delay = delay
+        self.requests : list[tuple[list, dict]] = []
+        self.lock = threading.Lock()
+
+    @property
+    def calls(self) -> int:
+        return len(self.requests)
+
+    def record(self, messages, kwargs):
+        called = [tool_call["id"] for message in messages for tool_call in message.get("tool_calls") or []]
+        answered = [message["tool_call_id"] for message in messages if message["role"] == "tool"]
+        if called != answered:
+            raise ValueError("tool calls without a response")
+        with self.lock:
+            self.requests.append((list(messages), dict(kwargs)))
+
+    def response(self, messages, model, kwargs) -> LLMResponse:
+        reply = self.respond(messages, model, kwargs)
+        if isinstance(reply, str):
+            reply = LLMResponse(model=model, raw_response={}, message=reply, tools=None)
+        return reply
+
+    def get_response(self, messages, model, **kwargs) -> LLMResponse:
+        self.record(messages, kwargs)
+        pop_deadline(kwargs)
+        if self.delay:
+            time.sleep(self.delay)
+        return self.response(messages, model, kwargs)
+
+    async def get_response_async(self, messages, model, **kwargs) -> LLMResponse:
+        self.record(messages, kwargs)
+        deadline = pop_deadline(kwargs)
+        await run_with_deadline(deadline, asyncio.sleep(self.delay))
+        return self.response(messages, model, kwargs)
+
+    def install(self, llm : LLM) -> LLM:
+        llm.provider.get_response = self.get_response
+        llm.provider.get_response_async = self.get_response_async
+        return llm
+
+def fake_llm(respond=None, model : str = "gpt-4", delay : float = 0, **kwargs) -> tuple[LLM, FakeProvider]:
+    provider = FakeProvider(respond, delay)
+    return provider.install(LLM(Provider.openai, model, api_key="test", **kwargs)), provider
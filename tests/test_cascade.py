@@ -0,0 +1,76 @@
+# python -m unittest discover -s tests -t .
+
+import asyncio
+import unittest
+
+from pydantic import BaseModel
+
+from muxllm.cascade import Cascade, schema_check, logprob_threshold
+from muxllm.providers.base import LLMResponse
+from tests.fakes import fake_llm
+
+class Capital(BaseModel):
+    country: str
+    capital: str
+
+def tier(model, message):
+    return fake_llm(lambda messages, model, kwargs: message, model=model)
+
+class TestCascade(unittest.TestCase):
+    def test_accepts_cheap_tier(self):
+        cheap, _ = tier("cheap", '{"country": "France", "capital": "Paris"}')
+        expensive, expensive_provider = tier("expensive", '{"country": "France", "capital": "Paris"}')
+        cascade = Cascade([cheap, expensive], accept=schema_check(Capital))
+        result = cascade.ask("What is the capital of {{country}}? Answer in json", country="France")
+        self.assertEqual(result.tier, 0)
+        self.assertEqual(expensive_provider.calls, 0)
+
+    def test_escalation_is_cached_per_template(self):
+        cheap, cheap_provider = tier("cheap", "I don't know")
+        expensive, _ = tier("expensive", '{"country": "France", "capital": "Paris"}')
+        cascade = Cascade([cheap, expensive], accept=schema_check(Capital), min_samples=3, probe_every=0)
+
+        for country in ["France", "Spain", "Italy", "Germany", "Peru"]:
+            result = cascade.ask("What is the capital of {{country}}? Answer in json", country=country)
+            self.assertEqual(result.tier, 1)
+        # after 3 rejections the cheap tier is skipped for this template
+        self.assertEqual(cheap_provider.calls, 3)
+        self.assertEqual(result.skipped, 1)
+        self.assertEqual(cascade.stats()["What is the capital of {{country}}? Answer in json"][0]["rejections"], 3)
+
+        # other templates still start at the cheap tier
+        cascade.ask("Name a city in {{country}}", country="France")
+        self.assertEqual(cheap_provider.calls, 4)
+
+    def test_template_stats_are_bounded(self):
+        cheap, _ = tier("cheap", "I don't know")
+        expensive, _ = tier("expensive", '{"country": "France", "capital": "Paris"}')
+        cascade = Cascade([cheap, expensive], accept=schema_check(Capital), min_samples=1, max_templates=2)
+
+        # already formatted prompts aren't templates, they are neither tracked nor skipped
+        for country in ["France", "Spain", "Italy"]:
+            self.assertEqual(cascade.ask(f"What is the capital of {country}?").skipped, 0)
+        self.assertEqual(cascade.stats(), {})
+
+        for template in ["A {{x}}", "B {{x}}", "C {{x}}"]:
+            cascade.ask(template, x="1")
+        self.assertEqual(list(cascade.stats()), ["B {{x}}", "C {{x}}"])
+        self.assertEqual(cascade.ask("C {{x}}", x="2").skipped, 1)
+
+    def test_async(self):
+        cheap, _ = tier("cheap", "not json")
+        expensive, _ = tier("expensive", "also not json, but the last tier is always accepted")
+        result = asyncio.run(Cascade([cheap, expensive], accept=schema_check(Capital)).ask_async("hi"))
+        self.assertEqual(result.tier, 1)
+        self.assertEqual([a.accepted for a in result.attempts], [False, True])
+
+    def test_logprob_threshold(self):
+        check = logprob_threshold(-0.5)
+        confident = {"choices": [{"logprobs": {"content": [{"logprob": -0.1}, {"logprob": -0.2}]}}]}
+        unsure = {"choices": [{"logprobs": {"content": [{"logprob": -2.0}, {"logprob": -0.2}]}}]}
+        self.assertTrue(check(LLMResponse(model="m", raw_response=confident, message="a", tools=None)))
+        self.assertFalse(check(LLMResponse(model="m", raw_response=unsure, message="a", tools=None)))
+        self.assertFalse(check(LLMResponse(model="m", raw_response={}, message="a", tools=None)))
+
+if __name__ == '__main__':
+    unittest.main()
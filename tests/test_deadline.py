@@ -0,0 +1,289 @@
+# python -m unittest discover -s tests -t .
+
+import asyncio
+import importlib
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+import openai
+
+from muxllm import LLM, Provider
+from muxllm.deadline import Deadline, DeadlineExceeded, Cancelled
+from muxllm.providers.base import LLMResponse, ToolCall
+from muxllm.singleflight import SingleFlight
+from muxllm.tools import ToolBox, tool, Param
+from muxllm.transport import Cassette
+from tests.fakes import fake_llm
+from tests.test_transport import completion, mock_upstream
+
+class TestDeadline(unittest.TestCase):
+    def test_deadline(self):
+        deadline = Deadline(0.05)
+        self.assertFalse(deadline.done)
+        self.assertLessEqual(deadline.remaining(), 0.05)
+        deadline.check()
+        time.sleep(0.06)
+        self.assertTrue(deadline.expired)
+        self.assertEqual(deadline.remaining(), 0.0)
+        with self.assertRaises(DeadlineExceeded):
+            deadline.check()
+        # DeadlineExceeded can be caught like any other timeout
+        self.assertTrue(issubclass(DeadlineExceeded, TimeoutError))
+
+        deadline = Deadline()
+        self.assertIsNone(deadline.remaining())
+        called = []
+        unregister = deadline.on_cancel(lambda: called.append(1))
+        deadline.on_cancel(lambda: called.append(2))
+        unregister()
+        deadline.cancel()
+        deadline.cancel()
+        self.assertEqual(called, [2])
+        with self.assertRaises(Cancelled):
+            deadline.check()
+        # callbacks registered after the cancellation run right away
+        deadline.on_cancel(lambda: called.append(3))
+        self.assertEqual(called, [2, 3])
+
+    def test_bound_client(self):
+        client = LLM(Provider.openai, "gpt-4", api_key="test").provider.client
+        self.assertIs(Deadline().bound_client(client), client)
+        # the client's retries are kept while there is time for them
+        bound = Deadline(30).bound_client(client)
+        self.assertLessEqual(bound.timeout, 30)
+        self.assertEqual(bound.max_retries, client.max_retries)
+        self.assertEqual(Deadline(1).bound_client(client).max_retries, 0)
+
+    def test_run(self):
+        async def slow():
+            await asyncio.sleep(1)
+
+        start = time.perf_counter()
+        with self.assertRaises(DeadlineExceeded):
+            asyncio.run(Deadline(0.05).run(slow()))
+        self.assertLess(time.perf_counter() - start, 0.5)
+
+        deadline = Deadline()
+        threading.Timer(0.05, deadline.cancel).start()
+        with self.assertRaises(Cancelled):
+            asyncio.run(deadline.run(slow()))
+
+        # a plain cancellation of the task is not swallowed
+        async def cancel_self():
+            task = asyncio.current_task()
+            asyncio.get_running_loop().call_later(0.05, task.cancel)
+            await Deadline(1).run(slow())
+        with self.assertRaises(asyncio.CancelledError):
+            asyncio.run(cancel_self())
+
+class TestProviderDeadline(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        path = os.path.join(self.directory.name, "cassette.jsonl")
+        transport, _ = mock_upstream()
+        llm = LLM(Provider.openai, "gpt-4", api_key="test", cassette=Cassette(path, mode="record", transport=transport))
+        llm.ask("hello world")
+        list(llm.ask_stream("a b c d e"))
+
+        # a slow upstream: completions take a second to start, streams send an event every 0.1s
+        cassette = Cassette(path, mode="replay", latency=1.0)
+        for interactions in cassette.interactions.values():
+            for interaction in interactions:
+                body = "".join(interaction["chunks"])
+                if body.startswith("data:"):
+                    interaction["ttfb"] = 0.0
+                    interaction["chunks"] = [event + "\n\n" for event in body.split("\n\n") if event]
+                else:
+                    interaction["ttfb"] = 1.0
+                interaction["offsets"] = [0.1 * (i + 1) for i in range(len(interaction["chunks"]))]
+        self.llm = LLM(Provider.openai, "gpt-4", cassette=cassette)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_async_deadline(self):
+        start = time.perf_counter()
+        with self.assertRaises(DeadlineExceeded):
+            asyncio.run(self.llm.ask_async("hello world", deadline=0.1))
+        self.assertLess(time.perf_counter() - start, 0.5)
+
+        deadline = Deadline()
+        threading.Timer(0.1, deadline.cancel).start()
+        with self.assertRaises(Cancelled):
+            asyncio.run(self.llm.ask_async("hello world", deadline=deadline))
+
+    def test_expired_before_call(self):
+        with self.assertRaises(DeadlineExceeded):
+            self.llm.ask("hello world", deadline=0)
+
+        deadline = Deadline()
+        deadline.cancel()
+        with self.assertRaises(Cancelled):
+            self.llm.ask("hello world", deadline=deadline)
+
+    def test_stream_cancel(self):
+        deadline = Deadline()
+        deltas = []
+        with self.assertRaises(Cancelled):
+            for chunk in self.llm.ask_stream("a b c d e", deadline=deadline):
+                deltas.append(chunk.delta)
+                deadline.cancel()
+        self.assertEqual(deltas, ["a"])
+
+        async def consume():
+            async for chunk in self.llm.ask_stream_async("a b c d e", deadline=0.25):
+                deltas.append(chunk.delta)
+        deltas = []
+        with self.assertRaises(DeadlineExceeded):
+            asyncio.run(consume())
+        self.assertEqual(deltas, ["a", "b"])
+
+def silent_server():
+    # accepts connections and never answers them
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    connections = []
+    def accept():
+        while True:
+            try:
+                connections.append(server.accept()[0])
+            except OSError:
+                return
+    threading.Thread(target=accept, daemon=True).start()
+    return server, connections
+
+def openai_llm(**client_kwargs):
+    llm = LLM(Provider.openai, "gpt-4", api_key="test")
+    llm.provider.client = openai.OpenAI(api_key="test", **client_kwargs)
+    return llm
+
+class TestSyncDeadline(unittest.TestCase):
+    def test_silent_upstream(self):
+        # retries of a sync call don't get the whole budget again
+        server, connections = silent_server()
+        try:
+            llm = openai_llm(base_url=f"http://127.0.0.1:{server.getsockname()[1]}/v1", max_retries=2)
+            start = time.perf_counter()
+            with self.assertRaises(DeadlineExceeded):
+                llm.ask("hi", deadline=0.5)
+            self.assertLess(time.perf_counter() - start, 1.0)
+            self.assertEqual(len(connections), 1)
+        finally:
+            server.close()
+            for connection in connections:
+                connection.close()
+
+    def test_retries_within_deadline(self):
+        httpx = importlib.import_module(openai.DefaultHttpxClient.__mro__[1].__module__.split(".")[0])
+        calls = []
+        def handler(request):
+            calls.append(request)
+            if len(calls) % 2 == 1:
+                return httpx.Response(500, json={"error": {"message": "overloaded"}})
+            return httpx.Response(200, json=completion("ok"))
+        llm = openai_llm(http_client=httpx.Client(transport=httpx.MockTransport(handler)), max_retries=2)
+
+        self.assertEqual(llm.ask("hi", deadline=5).message, "ok")
+        self.assertEqual(len(calls), 2)
+        # no retry when the backoff wouldn't fit in the time that is left
+        with self.assertRaises(openai.InternalServerError):
+            llm.ask("hi", deadline=0.3)
+        self.assertEqual(len(calls), 3)
+
+class TestToolDeadline(unittest.TestCase):
+    def test_tool_gets_deadline(self):
+        toolbox = ToolBox()
+        seen = []
+
+        @tool("wait", toolbox, "Waits until the deadline", [])
+        def wait(deadline):
+            seen.append(deadline)
+            while not deadline.done:
+                time.sleep(0.01)
+            return "stopped"
+
+        deadline = Deadline(0.05)
+        self.assertEqual(toolbox.invoke_tool(ToolCall(id="1", name="wait", args={}), deadline), "stopped")
+        self.assertIs(seen[0], deadline)
+
+    def test_run_tools_cancelled(self):
+        toolbox = ToolBox()
+
+        @tool("slow", toolbox, "A slow tool", [Param("n", "string", "a number")])
+        def slow(n):
+            time.sleep(1)
+            return str(n)
+
+        llm, _ = fake_llm(lambda messages, model, kwargs: LLMResponse(
+            model=model, raw_response={}, message="", tools=[ToolCall(id="1", name="slow", args={"n": "1"})]))
+
+        deadline = Deadline()
+        threading.Timer(0.05, deadline.cancel).start()
+        start = time.perf_counter()
+        run = llm.run_tools("go", toolbox, deadline=deadline)
+        self.assertEqual(run.stop_reason, "cancelled")
+        self.assertLess(time.perf_counter() - start, 0.5)
+
+        run = asyncio.run(llm.run_tools_async("go", toolbox, deadline=0.05))
+        self.assertEqual(run.stop_reason, "deadline")
+        self.assertLess(run.total_time, 0.5)
+
+class TestSingleFlightDeadline(unittest.TestCase):
+    def test_follower_deadline(self):
+        flight = SingleFlight()
+        started = threading.Event()
+
+        def leader(deadline):
+            started.set()
+            time.sleep(0.3)
+            return "done"
+
+        thread = threading.Thread(target=lambda: flight.do("key", leader))
+        thread.start()
+        started.wait()
+        start = time.perf_counter()
+        with self.assertRaises(DeadlineExceeded):
+            flight.do("key", leader, Deadline(0.05))
+        self.assertLess(time.perf_counter() - start, 0.2)
+        thread.join()
+
+    def test_shared_deadline(self):
+        flight = SingleFlight()
+        seen = []
+
+        def fn(deadline):
+            seen.append(deadline)
+            end = time.monotonic() + 0.15
+            while time.monotonic() < end:
+                deadline.check()
+                time.sleep(0.01)
+            return "done"
+
+        # the shared call runs until the last of its callers' deadlines
+        results = {}
+        def leader():
+            try:
+                flight.do("key", fn, Deadline(0.05))
+            except DeadlineExceeded as e:
+                results["leader"] = e
+        thread = threading.Thread(target=leader)
+        thread.start()
+        time.sleep(0.01)
+        self.assertEqual(flight.do("key", fn, Deadline(0.5)), "done")
+        thread.join()
+        self.assertIsInstance(results["leader"], DeadlineExceeded)
+        self.assertEqual(len(seen), 1)
+
+        # and is cancelled once every caller has given up
+        with self.assertRaises(DeadlineExceeded):
+            flight.do("key", fn, Deadline(0.05))
+        self.assertTrue(seen[1].cancelled)
+        self.assertEqual(flight.stats()["in_flight"], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+# python -m unittest discover -s tests -t .
+
+import asyncio
+import glob
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from muxllm.embeddings import VectorCache
+from muxllm.providers.base import BaseProvider
+
+class FakeEmbeddingProvider(BaseProvider):
+    embed_batch_size = 3
+
+    def __init__(self):
+        self.batches = []
+
+    def get_embeddings(self, texts, model, dimensions=3, **kwargs):
+        self.batches.append(list(texts))
+        return [([float(len(text)), float(sum(map(ord, text)) % 97)] + [1.0] * dimensions)[:dimensions] for text in texts]
+
+    async def get_embeddings_async(self, texts, model, **kwargs):
+        await asyncio.sleep(0.01)
+        return self.get_embeddings(texts, model, **kwargs)
+
+class TestEmbeddings(unittest.TestCase):
+    def test_batching(self):
+        provider = FakeEmbeddingProvider()
+        texts = [f"text {i}" for i in range(10)]
+        vectors = provider.embed(texts, "fake-model")
+        self.assertEqual(vectors.shape, (10, 3))
+        self.assertEqual(vectors.dtype, np.float32)
+        self.assertTrue(vectors.flags["C_CONTIGUOUS"])
+        self.assertEqual([len(batch) for batch in provider.batches], [3, 3, 3, 1])
+        np.testing.assert_array_equal(vectors[4], provider.get_embeddings(["text 4"], "fake-model")[0])
+
+    def test_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            provider = FakeEmbeddingProvider()
+            first = provider.embed(["a", "bb", "a"], "fake-model", cache=VectorCache(directory))
+            self.assertEqual(provider.batches, [["a", "bb"]])
+
+            provider.batches = []
+            # a new cache object reads the vectors back from disk
+            second = provider.embed(["bb", "ccc", "a"], "fake-model", cache=VectorCache(directory))
+            self.assertEqual(provider.batches, [["ccc"]])
+            np.testing.assert_array_equal(first[1], second[0])
+            np.testing.assert_array_equal(first[0], second[2])
+
+            provider.batches = []
+            provider.embed(["a"], "other-model", cache=VectorCache(directory))
+            self.assertEqual(provider.batches, [["a"]])
+
+    def test_cache_options(self):
+        with tempfile.TemporaryDirectory() as directory:
+            provider = FakeEmbeddingProvider()
+            cache = VectorCache(directory)
+            provider.embed(["a"], "fake-model", cache=cache, dimensions=3)
+            # kwargs that change the vectors get their own cache entries
+            vectors = provider.embed(["a", "b"], "fake-model", cache=cache, dimensions=8)
+            self.assertEqual(vectors.shape, (2, 8))
+            self.assertEqual(provider.batches, [["a"], ["a", "b"]])
+            # kwargs that don't, like the deadline, share them
+            provider.embed(["a"], "fake-model", cache=cache, dimensions=8, deadline=10)
+            self.assertEqual(len(provider.batches), 2)
+
+    def test_cache_interrupted_put(self):
+        with tempfile.TemporaryDirectory() as directory:
+            provider = FakeEmbeddingProvider()
+            provider.embed(["a"], "fake-model", cache=VectorCache(directory))
+            # a crash between writing the vectors and the keys leaves a row without a key
+            vectors_fp = glob.glob(os.path.join(directory, "*", "vectors.f32"))[0]
+            with open(vectors_fp, "ab") as f:
+                f.write(np.full(3, 9, dtype=np.float32).tobytes())
+
+            vectors = provider.embed(["a", "b"], "fake-model", cache=VectorCache(directory))
+            np.testing.assert_array_equal(vectors[1], provider.get_embeddings(["b"], "fake-model")[0])
+            provider.batches = []
+            reloaded = provider.embed(["a", "b"], "fake-model", cache=VectorCache(directory))
+            self.assertEqual(provider.batches, [])
+            np.testing.assert_array_equal(reloaded, vectors)
+            self.assertEqual(os.path.getsize(vectors_fp), 2 * 3 * 4)
+
+    def test_async(self):
+        provider = FakeEmbeddingProvider()
+        vectors = asyncio.run(provider.embed_async([f"text {i}" for i in range(7)], "fake-model"))
+        self.assertEqual(vectors.shape, (7, 3))
+        self.assertEqual(len(provider.batches), 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+# python -m unittest discover -s tests -t .
+
+import asyncio
+import contextlib
+import io
+import json
+import os
+import tempfile
+import time
+import unittest
+from types import SimpleNamespace
+
+from openai.types.chat import ChatCompletion
+
+from muxllm import LLM, Provider, profiling
+from muxllm.cli import main
+from muxllm.profiling import Histogram, Profiler, stage
+from muxllm.tools import ToolBox, tool, Param
+from tests.test_transport import completion
+
+toolbox = ToolBox()
+
+@tool("noop", toolbox, "Does nothing", [Param("x", "string", "anything")])
+def noop(x):
+    return x
+
+class StubCompletions:
+    # stands in for client.chat.completions of the openai sdk, so the provider's own code runs and is profiled
+    def create(self, **kwargs):
+        time.sleep(0.002)
+        return ChatCompletion.model_validate(completion("ok"))
+
+class AsyncStubCompletions:
+    async def create(self, **kwargs):
+        await asyncio.sleep(0.002)
+        return ChatCompletion.model_validate(completion("ok"))
+
+def stub_llm():
+    llm = LLM(Provider.openai, "gpt-4", api_key="test")
+    llm.provider.client = SimpleNamespace(chat=SimpleNamespace(completions=StubCompletions()))
+    llm.provider.async_client = SimpleNamespace(chat=SimpleNamespace(completions=AsyncStubCompletions()))
+    return llm
+
+class TestProfiling(unittest.TestCase):
+    def setUp(self):
+        profiling.profiler.reset()
+        profiling.enable()
+
+    def tearDown(self):
+        profiling.disable()
+        profiling.profiler.reset()
+
+    def test_histogram(self):
+        histogram = Histogram()
+        for ms in range(1, 101):
+            histogram.add(ms / 1000)
+        self.assertEqual(histogram.count, 100)
+        self.assertAlmostEqual(histogram.total, 5.05)
+        self.assertEqual(histogram.min, 0.001)
+        self.assertEqual(histogram.max, 0.1)
+        # percentiles are bucket upper bounds, so within a factor of two
+        self.assertTrue(0.05 <= histogram.percentile(50) <= 0.1)
+        self.assertEqual(histogram.percentile(100), 0.1)
+        self.assertEqual(Histogram.from_dict(histogram.to_dict()).buckets, histogram.buckets)
+
+    def test_stages(self):
+        llm = stub_llm()
+        for _ in range(3):
+            llm.ask("hello {{name}}", name="world")
+        llm.chat("hi", tools=toolbox)
+
+        stages = profiling.profiler.stages
+        self.assertEqual(stages["llm.ask"].count, 3)
+        self.assertEqual(stages["llm.chat"].count, 1)
+        self.assertEqual(stages["prompt.prep"].count, 4)
+        self.assertEqual(stages["tools.to_dict"].count, 1)
+        self.assertEqual(stages["provider.request"].count, 4)
+        self.assertGreaterEqual(stages["provider.request"].min, 0.002)
+        self.assertEqual(stages["response.parse"].count, 4)
+
+        stacks = profiling.profiler.stacks
+        self.assertIn(("llm.ask", "llm.get_response", "provider.request"), stacks)
+        self.assertIn(("llm.ask", "llm.get_response", "response.parse"), stacks)
+        self.assertIn(("llm.chat", "tools.to_dict"), stacks)
+        # self time excludes the children, so the stacks add up to the time of the outer stages
+        outer = stages["llm.ask"].total + stages["llm.chat"].total
+        self.assertAlmostEqual(sum(stacks.values()), outer, places=6)
+
+    def test_async_tasks(self):
+        llm = stub_llm()
+
+        async def run():
+            await asyncio.gather(*[llm.ask_async("hi") for _ in range(10)])
+        asyncio.run(run())
+        # concurrent tasks each keep their own stack
+        self.assertEqual(set(profiling.profiler.stacks), {
+            ("llm.ask",), ("llm.ask", "prompt.prep"), ("llm.ask", "llm.get_response"),
+            ("llm.ask", "llm.get_response", "provider.request"), ("llm.ask", "llm.get_response", "response.parse"),
+        })
+        self.assertEqual(profiling.profiler.stages["provider.request"].count, 10)
+
+    def test_disabled(self):
+        profiling.disable()
+        self.assertIsInstance(stage("anything"), contextlib.nullcontext)
+        stub_llm().ask("hi")
+        self.assertEqual(profiling.profiler.stages, {})
+
+    def test_dump_and_report(self):
+        stub_llm().ask("hi")
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "profile.json")
+            profiling.dump(path)
+            with open(path) as f:
+                self.assertIn("llm.ask", json.load(f)["stages"])
+            self.assertEqual(Profiler.load(path).stacks.keys(), profiling.profiler.stacks.keys())
+
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                main(["profile", "report", path])
+            self.assertIn("provider.request", out.getvalue())
+
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                main(["profile", "report", path, "--folded"])
+            lines = out.getvalue().strip().split("\n")
+            self.assertIn("llm.ask;llm.get_response;provider.request", [line.rsplit(" ", 1)[0] for line in lines])
+            self.assertTrue(all(line.rsplit(" ", 1)[1].isdigit() for line in lines))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+# python -m unittest discover -s tests -t .
+
+import asyncio
+import json
+import unittest
+
+from muxllm.deadline import Cancelled, pop_deadline, run_with_deadline
+from muxllm.providers.base import CloudProvider, LLMResponse, ToolCall
+from muxllm.server import Gateway
+from muxllm.streaming import StreamAssembler
+
+class EchoProvider(CloudProvider):
+    def __init__(self):
+        super().__init__({})
+        self.calls = 0
+        self.cancelled = 0
+        self.delay = 0.05
+
+    async def get_response_async(self, messages, model, **kwargs):
+        self.calls += 1
+        deadline = pop_deadline(kwargs)
+        try:
+            await run_with_deadline(deadline, asyncio.sleep(self.delay))
+        except (Cancelled, asyncio.CancelledError):
+            self.cancelled += 1
+            raise
+        if "tools" in kwargs:
+            return LLMResponse(model=model, raw_response={}, message=None,
+                               tools=[ToolCall(id="call_1", name="get_current_weather", args={"location": "Paris"})])
+        return LLMResponse(model=model, raw_response={}, message=messages[-1]["content"], tools=None)
+
+    async def get_response_stream_async(self, messages, model, **kwargs):
+        self.calls += 1
+        pop_deadline(kwargs)
+        assembler = StreamAssembler(model)
+        for word in messages[-1]["content"].split(" "):
+            await asyncio.sleep(0.01)
+            assembler.add_text(word + " ")
+            yield assembler.chunk({})
+        yield assembler.finish({})
+
+async def request(port, method, path, body=None):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    data = json.dumps(body).encode() if body is not None else b""
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode() + data)
+    await writer.drain()
+    raw = await reader.read()
+    writer.close()
+    head, _, payload = raw.partition(b"\r\n\r\n")
+    status = int(head.split(b" ")[1])
+    return status, head.decode(), payload
+
+def completion_body(content, **kwargs):
+    return {"model": "echo/test-model", "messages": [{"role": "user", "content": content}], **kwargs}
+
+class TestServer(unittest.TestCase):
+    def run_gateway(self, test, **kwargs):
+        async def main():
+            provider = EchoProvider()
+            gateway = Gateway(providers={"echo": provider}, **kwargs)
+            server = await gateway.start("127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            try:
+                await test(gateway, provider, port)
+            finally:
+                server.close()
+                await server.wait_closed()
+        asyncio.run(main())
+
+    def test_health_and_metrics(self):
+        async def test(gateway, provider, port):
+            status, _, payload = await request(port, "GET", "/health")
+            self.assertEqual(status, 200)
+            self.assertEqual(json.loads(payload), {"status": "ok"})
+            status, _, payload = await request(port, "GET", "/metrics")
+            self.assertEqual(status, 200)
+            self.assertIn(b"muxllm_requests_total", payload)
+        self.run_gateway(test)
+
+    def test_completion(self):
+        async def test(gateway, provider, port):
+            status, _, payload = await request(port, "POST", "/v1/chat/completions", completion_body("hello"))
+            self.assertEqual(status, 200)
+            completion = json.loads(payload)
+            self.assertEqual(completion["object"], "chat.completion")
+            self.assertEqual(completion["choices"][0]["message"]["content"], "hello")
+
+            status, _, payload = await request(port, "POST", "/v1/chat/completions", completion_body("weather?", tools=[]))
+            completion = json.loads(payload)
+            self.assertEqual(completion["choices"][0]["finish_reason"], "tool_calls")
+            self.assertEqual(json.loads(completion["choices"][0]["message"]["tool_calls"][0]["function"]["arguments"]), {"location": "Paris"})
+        self.run_gateway(test)
+
+    def test_streaming(self):
+        async def test(gateway, provider, port):
+            status, head, payload = await request(port, "POST", "/v1/chat/completions", completion_body("hello there world", stream=True))
+            self.assertEqual(status, 200)
+            self.assertIn("text/event-stream", head)
+            self.assertIn(b"data: [DONE]", payload)
+            events = [json.loads(line[6:]) for line in payload.decode().split("\r\n") if line.startswith("data: {")]
+            content = "".join(event["choices"][0]["delta"].get("content", "") for event in events)
+            self.assertEqual(content, "hello there world ")
+            self.assertEqual(events[-1]["choices"][0]["finish_reason"], "stop")
+        self.run_gateway(test)
+
+    def test_cache_and_coalescing(self):
+        async def test(gateway, provider, port):
+            results = await asyncio.gather(*[request(port, "POST", "/v1/chat/completions", completion_body("same")) for _ in range(20)])
+            self.assertTrue(all(status == 200 for status, _, _ in results))
+            await request(port, "POST", "/v1/chat/completions", completion_body("same"))
+            self.assertEqual(provider.calls, 1)
+        self.run_gateway(test, cache_size=16)
+
+    def test_errors(self):
+        async def test(gateway, provider, port):
+            status, _, _ = await request(port, "POST", "/v1/chat/completions", {"model": "no-provider", "messages": []})
+            self.assertEqual(status, 400)
+            status, _, _ = await request(port, "POST", "/v1/chat/completions", {"model": "nope/model", "messages": []})
+            self.assertEqual(status, 404)
+            status, _, _ = await request(port, "GET", "/v1/unknown")
+            self.assertEqual(status, 404)
+
+            for length in ("abc", "-5", "\xb2"):
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                writer.write(f"POST /v1/chat/completions HTTP/1.1\r\nContent-Length: {length}\r\n\r\n".encode("latin-1"))
+                await writer.drain()
+                raw = await reader.read()
+                writer.close()
+                self.assertTrue(raw.startswith(b"HTTP/1.1 400"))
+        self.run_gateway(test)
+
+    def test_timeout_and_disconnect(self):
+        async def test(gateway, provider, port):
+            provider.delay = 0.5
+            status, _, payload = await request(port, "POST", "/v1/chat/completions", completion_body("slow"))
+            self.assertEqual(status, 504)
+            self.assertEqual(json.loads(payload)["error"]["type"], "timeout_error")
+            await asyncio.sleep(0.05)
+            # nobody else waits for the upstream call, so it is cancelled too
+            self.assertEqual(provider.cancelled, 1)
+
+            # a client that goes away cancels its upstream call
+            gateway.request_timeout = None
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            data = json.dumps(completion_body("abandoned")).encode()
+            writer.write(f"POST /v1/chat/completions HTTP/1.1\r\nContent-Length: {len(data)}\r\n\r\n".encode() + data)
+            await writer.drain()
+            await asyncio.sleep(0.05)
+            writer.close()
+            await asyncio.sleep(0.3)
+            self.assertEqual(provider.cancelled, 2)
+        self.run_gateway(test, request_timeout=0.1)
+
+    def test_disconnect_while_coalesced(self):
+        async def test(gateway, provider, port):
+            provider.delay = 0.3
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            data = json.dumps(completion_body("shared")).encode()
+            writer.write(f"POST /v1/chat/completions HTTP/1.1\r\nContent-Length: {len(data)}\r\n\r\n".encode() + data)
+            await writer.drain()
+            await asyncio.sleep(0.05)
+
+            # a second client joins the upstream call of the first one, which then goes away
+            other = asyncio.ensure_future(request(port, "POST", "/v1/chat/completions", completion_body("shared")))
+            await asyncio.sleep(0.05)
+            writer.close()
+            status, _, payload = await other
+            self.assertEqual(status, 200)
+            self.assertEqual(json.loads(payload)["choices"][0]["message"]["content"], "shared")
+            self.assertEqual(provider.calls, 1)
+            self.assertEqual(provider.cancelled, 0)
+        self.run_gateway(test)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+# python -m unittest discover -s tests -t .
+
+import asyncio
+import gc
+import os
+import tempfile
+import threading
+import unittest
+
+from muxllm import Provider
+from muxllm.sessions import SessionManager
+from tests.fakes import FakeProvider
+
+def counting_manager(**kwargs):
+    # the fake provider answers with the number of messages it was sent
+    manager = SessionManager(Provider.openai, "gpt-4", api_key="test", system_prompt="You are a helpful assistant", **kwargs)
+    provider = FakeProvider(lambda messages, model, kwargs: str(len(messages)), delay=0.001)
+    provider.install(manager.llm)
+    return manager, provider
+
+class TestSessions(unittest.TestCase):
+    def test_shared_prompt_and_tools(self):
+        tools = [{"type": "function", "function": {"name": "noop", "description": "", "parameters": {}}}]
+        manager, provider = counting_manager(tools=tools)
+        session = manager.session("a")
+        self.assertEqual(session.chat("hi").message, "2")
+        self.assertEqual(session.chat("again").message, "4")
+
+        messages, kwargs = provider.requests[-1]
+        self.assertEqual(messages[0], {"role": "system", "content": "You are a helpful assistant"})
+        self.assertIs(kwargs["tools"], tools)
+        # the system prompt is not copied into every session
+        self.assertEqual([message["role"] for message in session.history], ["user", "assistant", "user", "assistant"])
+        self.assertIs(manager.session("a"), session)
+        self.assertEqual(manager.session("b").history, [])
+
+    def test_threads(self):
+        manager, provider = counting_manager()
+        sessions = [manager.session(f"user-{i}") for i in range(10)]
+
+        def worker(i):
+            for turn in range(10):
+                sessions[(i + turn) % len(sessions)].chat(f"turn {turn}")
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(provider.requests), 100)
+        for session in sessions:
+            # turns were never interleaved, every user message is followed by its answer
+            self.assertEqual(len(session.history), 20)
+            self.assertEqual([message["role"] for message in session.history], ["user", "assistant"] * 10)
+            self.assertEqual([message["content"] for message in session.history[1::2]], [str(i) for i in range(2, 22, 2)])
+
+    def test_async(self):
+        manager, provider = counting_manager()
+        session = manager.session("a")
+
+        async def main():
+            await asyncio.gather(*[session.chat_async(f"turn {i}") for i in range(20)])
+        asyncio.run(main())
+        self.assertEqual([message["content"] for message in session.history[1::2]], [str(i) for i in range(2, 42, 2)])
+
+    def test_failed_turn(self):
+        manager, provider = counting_manager()
+        session = manager.session("a")
+
+        def fail(messages, model, kwargs):
+            raise RuntimeError("upstream error")
+        provider.respond = fail
+        with self.assertRaises(RuntimeError):
+            session.chat("hi")
+        self.assertEqual(session.history, [])
+
+    def test_eviction(self):
+        with tempfile.TemporaryDirectory() as directory:
+            manager, provider = counting_manager(max_sessions=3, storage_dir=directory)
+            for i in range(5):
+                manager.session(f"user-{i}").chat(f"hello from {i}")
+            gc.collect()
+            self.assertEqual(len(manager), 3)
+            self.assertEqual(len(os.listdir(directory)), 2)
+            self.assertEqual(manager.stats(), {"resident": 3, "evictions": 2, "loads": 0})
+
+            # loaded back from disk, evicting the least recently used session
+            session = manager.session("user-0")
+            self.assertEqual(manager.stats()["loads"], 1)
+            self.assertEqual(session.history[0]["content"], "hello from 0")
+            self.assertEqual(session.chat("back again").message, "4")
+            self.assertNotIn("user-2", manager.sessions)
+
+            # a handle that is kept while its session is evicted stays the same session
+            kept = manager.session("user-3")
+            for i in range(5, 8):
+                manager.session(f"user-{i}")
+            self.assertNotIn("user-3", manager.sessions)
+            self.assertIs(manager.session("user-3"), kept)
+            kept.chat("still here")
+            self.assertEqual(len(kept.history), 4)
+
+            manager.flush()
+            manager.delete("user-0")
+            self.assertNotIn("user-0", manager.sessions)
+            self.assertEqual(manager.session("user-0").history, [])
+
+            # a handle kept through a delete carries on as a new session
+            manager.delete("user-3")
+            self.assertEqual(kept.chat("again").message, "2")
+            self.assertEqual(len(kept.history), 2)
+            self.assertIs(manager.session("user-3"), kept)
+
+if __name__ == '__main__':
+    unittest.main()
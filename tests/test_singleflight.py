@@ -0,0 +1,173 @@
+# python -m unittest discover -s tests -t .
+
+import asyncio
+import threading
+import time
+import unittest
+
+from muxllm import SingleFlight, DeadlineExceeded
+from muxllm.singleflight import request_key
+from tests.fakes import fake_llm
+
+class TestSingleFlight(unittest.TestCase):
+    def test_request_key(self):
+        messages = [{"role": "user", "content": "hi"}]
+        self.assertEqual(request_key("openai", "gpt-4", messages, temperature=1, top_p=.5),
+                         request_key("openai", "gpt-4", messages, top_p=.5, temperature=1))
+        self.assertEqual(request_key("openai", "gpt-4", messages),
+                         request_key("openai", "gpt-4", messages, timeout=10))
+        self.assertNotEqual(request_key("openai", "gpt-4", messages),
+                            request_key("groq", "gpt-4", messages))
+
+    def test_threads(self):
+        flight = SingleFlight()
+        calls = []
+        start = threading.Barrier(8)
+
+        def fn(deadline):
+            calls.append(1)
+            time.sleep(0.2)
+            return "result"
+
+        results = []
+        def worker():
+            start.wait()
+            results.append(flight.do("key", fn))
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(results, ["result"] * 8)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.deduplicated, 7)
+        self.assertEqual(flight.stats()["in_flight"], 0)
+
+    def test_tasks(self):
+        flight = SingleFlight()
+        calls = []
+
+        async def fn():
+            calls.append(1)
+            await asyncio.sleep(0.1)
+            return "result"
+
+        async def main():
+            return await asyncio.gather(*[flight.do_async("key", fn) for _ in range(8)])
+
+        self.assertEqual(asyncio.run(main()), ["result"] * 8)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.deduplicated, 7)
+
+    def test_errors_are_shared(self):
+        flight = SingleFlight()
+
+        async def fn():
+            await asyncio.sleep(0.1)
+            raise ValueError("upstream failed")
+
+        async def main():
+            return await asyncio.gather(*[flight.do_async("key", fn) for _ in range(4)], return_exceptions=True)
+
+        results = asyncio.run(main())
+        self.assertTrue(all(isinstance(r, ValueError) for r in results))
+        self.assertEqual(flight.stats()["in_flight"], 0)
+
+    def test_cancelled_caller(self):
+        flight = SingleFlight()
+        calls = []
+
+        async def fn():
+            calls.append(1)
+            await asyncio.sleep(0.1)
+            return "result"
+
+        async def main():
+            leader = asyncio.ensure_future(flight.do_async("key", fn))
+            await asyncio.sleep(0)
+            follower = asyncio.ensure_future(flight.do_async("key", fn))
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            return await asyncio.gather(leader, follower, return_exceptions=True)
+
+        leader, follower = asyncio.run(main())
+        # only the cancelled caller is affected, the shared call keeps running for the others
+        self.assertIsInstance(leader, asyncio.CancelledError)
+        self.assertEqual(follower, "result")
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.stats()["in_flight"], 0)
+
+    def test_abandoned_call(self):
+        flight = SingleFlight()
+        cancelled = []
+
+        async def fn():
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                cancelled.append(1)
+                raise
+
+        async def main():
+            callers = [asyncio.ensure_future(flight.do_async("key", fn)) for _ in range(2)]
+            await asyncio.sleep(0.01)
+            for caller in callers:
+                caller.cancel()
+            await asyncio.gather(*callers, return_exceptions=True)
+            await asyncio.sleep(0)
+
+        # the shared call is cancelled once every caller is gone
+        asyncio.run(main())
+        self.assertEqual(cancelled, [1])
+        self.assertEqual(flight.stats()["in_flight"], 0)
+
+    def test_leader_deadline(self):
+        # the caller that starts the shared call only bounds its own wait, not the call
+        flight = SingleFlight()
+        llm, provider = fake_llm(lambda messages, model, kwargs: "Paris", delay=0.2, single_flight=flight)
+
+        results = {}
+        def leader():
+            try:
+                llm.ask("What is the capital of France?", deadline=0.05)
+            except DeadlineExceeded as e:
+                results["leader"] = e
+        thread = threading.Thread(target=leader)
+        thread.start()
+        time.sleep(0.01)
+        results["follower"] = llm.ask("What is the capital of France?")
+        thread.join()
+        self.assertIsInstance(results["leader"], DeadlineExceeded)
+        self.assertEqual(results["follower"].message, "Paris")
+
+        async def main():
+            leader = asyncio.ensure_future(llm.ask_async("What is the capital of France?", deadline=0.05))
+            await asyncio.sleep(0.01)
+            follower = asyncio.ensure_future(llm.ask_async("What is the capital of France?"))
+            return await asyncio.gather(leader, follower, return_exceptions=True)
+
+        leader, follower = asyncio.run(main())
+        self.assertIsInstance(leader, DeadlineExceeded)
+        self.assertEqual(follower.message, "Paris")
+        self.assertEqual(provider.calls, 2)
+        # the sync call gets a deadline of its own, which the follower without a deadline lifted
+        (_, sync_kwargs), (_, async_kwargs) = provider.requests
+        self.assertIsNone(sync_kwargs["deadline"].expires_at)
+        self.assertFalse(sync_kwargs["deadline"].done)
+        self.assertNotIn("deadline", async_kwargs)
+
+    def test_llm(self):
+        flight = SingleFlight()
+        llm, provider = fake_llm(lambda messages, model, kwargs: "Paris", delay=0.1, single_flight=flight)
+
+        async def main():
+            return await asyncio.gather(*[llm.ask_async("What is the capital of France?") for _ in range(4)])
+
+        responses = asyncio.run(main())
+        self.assertEqual([r.message for r in responses], ["Paris"] * 4)
+        self.assertEqual(provider.calls, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+# python -m unittest discover -s tests -t .
+
+import json
+import unittest
+from types import SimpleNamespace
+
+from pydantic import BaseModel
+
+from muxllm.providers.base import CloudProvider
+from muxllm.streaming import IncrementalJSONParser, StreamAssembler, parse_partial
+
+def openai_chunk(content=None, tool_calls=None):
+    delta = SimpleNamespace(content=content, tool_calls=tool_calls)
+    return SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+def tool_delta(index, arguments, id=None, name=None):
+    return SimpleNamespace(index=index, id=id, function=SimpleNamespace(name=name, arguments=arguments))
+
+class Weather(BaseModel):
+    location: str
+    days: list[int]
+
+class TestStreaming(unittest.TestCase):
+    def test_parse_partial(self):
+        self.assertEqual(parse_partial('{"location": "San Fr'), {"location": "San Fr"})
+        self.assertEqual(parse_partial('{"location": "Paris", "days": [1, 2'), {"location": "Paris", "days": [1, 2]})
+        self.assertEqual(parse_partial('{"a": tr'), {})
+        self.assertEqual(parse_partial('{"a": "x\\u00'), {"a": "x"})
+        self.assertEqual(parse_partial('{"a": 1.5e'), {"a": 1.5})
+        self.assertEqual(parse_partial('{"a"'), {})
+        self.assertEqual(parse_partial(''), None)
+        with self.assertRaises(ValueError):
+            parse_partial('{"a": x')
+
+    def test_incremental_parser(self):
+        text = '{"location": "Paris, \\"FR\\"", "days": [1, {"x": "}"}]}'
+        parser = IncrementalJSONParser()
+        for i, c in enumerate(text):
+            parser.feed(c)
+            self.assertEqual(parser.complete, i == len(text) - 1)
+        self.assertEqual(parser.value, json.loads(text))
+
+    def test_incremental_partial(self):
+        text = '{"a": [1, {"b": "x\\\\y\\u00e9"}, [true, null]], "c": -1.5e3, "d": "long text"}'
+        parser = IncrementalJSONParser()
+        snapshots = []
+        for i in range(0, len(text), 3):
+            parser.feed(text[i:i + 3])
+            snapshots.append((text[:i + 3], parser.partial, json.dumps(parser.partial)))
+        # each partial matches a parse of the whole prefix and isn't changed by later feeds
+        for prefix, partial, dumped in snapshots:
+            self.assertEqual(partial, parse_partial(prefix))
+            self.assertEqual(json.dumps(partial), dumped)
+        self.assertEqual(parser.partial, json.loads(text))
+
+        # closed values are shared between snapshots instead of being rebuilt
+        parser = IncrementalJSONParser()
+        parser.feed('{"a": [1, 2], "b": "Par')
+        first = parser.partial
+        parser.feed('is')
+        self.assertIs(parser.partial["a"], first["a"])
+        self.assertEqual(first["b"], "Par")
+
+    def test_tool_calls_are_emitted_early(self):
+        provider = CloudProvider({})
+        assembler = StreamAssembler("gpt-4")
+        chunks = [
+            openai_chunk(tool_calls=[tool_delta(0, "", id="call_1", name="get_current_weather")]),
+            openai_chunk(tool_calls=[tool_delta(0, '{"location": "Par')]),
+            openai_chunk(tool_calls=[tool_delta(0, 'is"}')]),
+            openai_chunk(tool_calls=[tool_delta(1, '{"location"', id="call_2", name="get_current_weather")]),
+            openai_chunk(tool_calls=[tool_delta(1, ': "Rome"}')]),
+        ]
+
+        emitted = []
+        for chunk in chunks:
+            provider.add_stream_event(assembler, chunk)
+            out = assembler.chunk(chunk)
+            emitted.append([tool.args["location"] for tool in out.tools or []])
+            if len(emitted) == 2:
+                self.assertEqual(out.partial_tools[0]["args"], {"location": "Par"})
+        self.assertEqual(emitted, [[], [], ["Paris"], [], ["Rome"]])
+
+        final = assembler.finish(None)
+        self.assertTrue(final.done)
+        self.assertEqual([tool.id for tool in final.response.tools], ["call_1", "call_2"])
+
+    def test_structured_output(self):
+        assembler = StreamAssembler("gpt-4", response_model=Weather)
+        partials = []
+        for piece in ['{"loca', 'tion": "Paris", "da', 'ys": [1, 2', ']}']:
+            assembler.add_text(piece)
+            partials.append(assembler.chunk(None).partial)
+        self.assertEqual(partials[1], {"location": "Paris"})
+        self.assertEqual(partials[2], {"location": "Paris", "days": [1, 2]})
+
+        final = assembler.finish(None)
+        self.assertEqual(final.parsed, Weather(location="Paris", days=[1, 2]))
+        self.assertEqual(final.response.message, '{"location": "Paris", "days": [1, 2]}')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,13 @@
 # python -m unittest discover -s tests -t .
 
+import asyncio
+import time
 import unittest
 
 from muxllm import LLM, Provider
 from muxllm.tools import tool, Param, ToolBox
-from muxllm.providers.base import ToolCall
+from muxllm.providers.base import ToolCall, LLMResponse
+from tests.fakes import fake_llm
 
 my_tools = ToolBox()
 
@@ -123,6 +126,98 @@ class TestTools(unittest.TestCase):
         response = llm.chat("Please tell me what the tool said")
         self.assertTrue("sunny" in response.message.lower())
 
+slow_tools = ToolBox()
+
+@tool("slow_weather", slow_tools, "Get the current weather slowly", [
+    Param("location", "string", "The city and state, e.g. San Francisco, CA")
+])
+def slow_weather(location):
+    time.sleep(0.2)
+    return f"It is sunny in {location}"
+
+@tool("quick_weather", slow_tools, "Get the current weather quickly", [
+    Param("location", "string", "The city and state, e.g. San Francisco, CA")
+])
+def quick_weather(location):
+    return f"It is sunny in {location}"
+
+def mixed_script(messages, model, kwargs):
+    # one tool that finishes before the deadline and one that doesn't
+    return LLMResponse(model=model, raw_response={}, message="", tools=[
+        ToolCall(id=f"{len(messages)}-1", name="quick_weather", args={"location": "Paris"}),
+        ToolCall(id=f"{len(messages)}-2", name="slow_weather", args={"location": "Rome"}),
+    ])
+
+def weather_script(rounds=1):
+    # asks for the weather in two cities for the given number of rounds, then answers
+    calls = []
+    def respond(messages, model, kwargs):
+        calls.append(1)
+        if len(calls) > rounds:
+            return "It is sunny everywhere"
+        return LLMResponse(model=model, raw_response={}, message="", tools=[
+            ToolCall(id=f"{len(calls)}-1", name="slow_weather", args={"location": "Paris"}),
+            ToolCall(id=f"{len(calls)}-2", name="slow_weather", args={"location": "Rome"}),
+        ])
+    return respond
+
+def scripted_llm(rounds=1):
+    llm, _ = fake_llm(weather_script(rounds))
+    return llm
+
+class TestRunTools(unittest.TestCase):
+    def test_run_tools(self):
+        llm = scripted_llm()
+        run = llm.run_tools("What is the weather in Paris and Rome?", slow_tools)
+        self.assertEqual(run.stop_reason, "done")
+        self.assertEqual(run.response.message, "It is sunny everywhere")
+        self.assertEqual(len(run.steps), 2)
+        # both tools ran at the same time
+        self.assertLess(run.steps[0].tool_time, 0.35)
+        self.assertEqual(len(run.steps[0].tool_times), 2)
+        self.assertEqual([msg["role"] for msg in llm.history], ["user", "assistant", "tool", "tool", "assistant"])
+        self.assertEqual(llm.history[2]["content"], "It is sunny in Paris")
+
+    def test_run_tools_budgets(self):
+        llm = scripted_llm(rounds=10)
+        run = llm.run_tools("weather?", slow_tools, max_steps=3)
+        self.assertEqual(run.stop_reason, "max_steps")
+        self.assertEqual(len(run.steps), 3)
+        # the last turn's tool calls get a response without being run, so the chat can go on
+        self.assertEqual([msg["role"] for msg in llm.history[-3:]], ["assistant", "tool", "tool"])
+        self.assertEqual(llm.history[-1]["content"], "Not run: step budget exhausted")
+        self.assertEqual(len(llm.chat("and now?").tools), 2)
+
+        llm = scripted_llm(rounds=10)
+        run = llm.run_tools("weather?", slow_tools, deadline=0.1)
+        self.assertEqual(run.stop_reason, "deadline")
+        self.assertLess(run.total_time, 0.2)
+        self.assertEqual(llm.history[-1]["content"], "Not run: deadline exceeded")
+        llm.chat("and now?")
+
+        llm, _ = fake_llm(mixed_script)
+        run = llm.run_tools("weather?", slow_tools, deadline=0.1)
+        self.assertEqual([msg["content"] for msg in llm.history[-2:]], ["It is sunny in Paris", "Not run: deadline exceeded"])
+
+    def test_run_tools_async(self):
+        llm, provider = fake_llm(weather_script())
+        run = asyncio.run(llm.run_tools_async("What is the weather in Paris and Rome?", slow_tools))
+        self.assertEqual(run.stop_reason, "done")
+        self.assertLess(run.steps[0].tool_time, 0.35)
+        self.assertEqual(llm.history[3]["content"], "It is sunny in Rome")
+
+        provider.respond = weather_script(rounds=10)
+        run = asyncio.run(llm.run_tools_async("And in Paris and Rome?", slow_tools, deadline=0.1))
+        self.assertEqual(run.stop_reason, "deadline")
+        self.assertEqual([msg["role"] for msg in llm.history[-3:]], ["assistant", "tool", "tool"])
+        self.assertEqual(llm.history[-1]["content"], "Not run: deadline exceeded")
+
+        # a tool that finished before the deadline keeps its result
+        provider.respond = mixed_script
+        run = asyncio.run(llm.run_tools_async("And now?", slow_tools, deadline=0.1))
+        self.assertEqual(run.stop_reason, "deadline")
+        self.assertEqual([msg["content"] for msg in llm.history[-2:]], ["It is sunny in Paris", "Not run: deadline exceeded"])
+        self.assertEqual(len(run.steps[0].tool_times), 1)
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
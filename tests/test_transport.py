@@ -0,0 +1,91 @@
+# python -m unittest discover -s tests -t .
+
+import asyncio
+import importlib
+import json
+import os
+import tempfile
+import time
+import unittest
+
+import openai
+
+from muxllm import LLM, Provider
+from muxllm.transport import Cassette, CassetteMiss
+
+def completion(content):
+    return {
+        "id": "chatcmpl-1", "object": "chat.completion", "created": 0, "model": "gpt-4",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+    }
+
+def sse(words):
+    events = []
+    for word in words:
+        chunk = {"id": "chatcmpl-1", "object": "chat.completion.chunk", "created": 0, "model": "gpt-4",
+                 "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}]}
+        events.append(f"data: {json.dumps(chunk)}\n\n")
+    events.append("data: [DONE]\n\n")
+    return "".join(events).encode("utf-8")
+
+def mock_upstream():
+    # a fake openai api, using the same httpx package as the openai sdk
+    httpx = importlib.import_module(openai.DefaultHttpxClient.__mro__[1].__module__.split(".")[0])
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        body = json.loads(request.content)
+        prompt = body["messages"][-1]["content"]
+        if body.get("stream"):
+            return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=sse(prompt.split(" ")))
+        return httpx.Response(200, json=completion(prompt.upper()))
+
+    return httpx.MockTransport(handler), calls
+
+class TestTransport(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "cassette.jsonl.gz")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_record_replay(self):
+        transport, calls = mock_upstream()
+        cassette = Cassette(self.path, mode="record", transport=transport, async_transport=transport)
+        llm = LLM(Provider.openai, "gpt-4", api_key="test", cassette=cassette)
+        self.assertEqual(llm.ask("hello world").message, "HELLO WORLD")
+        self.assertEqual(asyncio.run(llm.ask_async("async hello")).message, "ASYNC HELLO")
+        self.assertEqual([chunk.delta for chunk in llm.ask_stream("a b c") if not chunk.done], ["a", "b", "c"])
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(len(cassette), 3)
+
+        # no api key and no upstream when replaying
+        llm = LLM(Provider.openai, "gpt-4", cassette=Cassette(self.path, mode="replay"))
+        self.assertEqual(llm.ask("hello world").message, "HELLO WORLD")
+        self.assertEqual(asyncio.run(llm.ask_async("async hello")).message, "ASYNC HELLO")
+        chunks = list(llm.ask_stream("a b c"))
+        self.assertEqual([chunk.delta for chunk in chunks if not chunk.done], ["a", "b", "c"])
+        self.assertEqual(chunks[-1].response.message, "abc")
+        self.assertEqual(len(calls), 3)
+
+        # depending on the sdk version, the miss is raised as is or wrapped in a connection error
+        with self.assertRaises((CassetteMiss, openai.APIConnectionError)) as error:
+            llm.ask("this was never recorded")
+        self.assertTrue(isinstance(error.exception, CassetteMiss) or isinstance(error.exception.__cause__, CassetteMiss))
+
+    def test_replay_latency(self):
+        transport, _ = mock_upstream()
+        llm = LLM(Provider.openai, "gpt-4", api_key="test", cassette=Cassette(self.path, mode="record", transport=transport))
+        llm.ask("hello")
+
+        cassette = Cassette(self.path, mode="replay", latency=1.0)
+        cassette.interactions[next(iter(cassette.interactions))][0]["ttfb"] = 0.2
+        llm = LLM(Provider.openai, "gpt-4", cassette=cassette)
+        start = time.perf_counter()
+        llm.ask("hello")
+        self.assertGreaterEqual(time.perf_counter() - start, 0.2)
+
+if __name__ == '__main__':
+    unittest.main()